@@ -0,0 +1,124 @@
+import os
+import json
+import datetime
+import threading
+from sqlalchemy import create_engine, MetaData, Table, Column, String, Float, Boolean, DateTime, select, and_
+from aliyunsdkcore.client import AcsClient
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from aliyunsdkecs.request.v20140526 import DescribeSpotPriceHistoryRequest
+from . import ALI_CONF
+from ..colorMessage import dyeFAIL
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# DescribeSpotPriceHistory looks back 3 hours if StartTime is not given
+DEFAULT_WINDOW = datetime.timedelta(hours=3)
+
+metadata = MetaData()
+
+spot_price_table = Table('spot_price', metadata,
+    Column('InstanceType', String, primary_key=True),
+    Column('ZoneId', String, primary_key=True),
+    Column('NetworkType', String, primary_key=True),
+    Column('Timestamp', String, primary_key=True),
+    Column('IoOptimized', Boolean),
+    Column('OriginPrice', Float),
+    Column('SpotPrice', Float))
+
+price_range_table = Table('price_range', metadata,
+    Column('InstanceType', String, primary_key=True),
+    Column('start', DateTime),
+    Column('end', DateTime))
+
+
+class PriceCache(object):
+    """Spot price history of instance types, shared by all projects in a sqlite file.
+
+    price_range records the time span fetched for each instance type. A query
+    inside the span is answered locally, only the missing head and the tail
+    older than `ttl` seconds are fetched from DescribeSpotPriceHistory.
+    """
+    def __init__(self, db_path, ttl=600):
+        super(PriceCache, self).__init__()
+        self.db_path = db_path
+        self.ttl = ttl
+        self.engine = None
+        self.client = None
+        self.lock = threading.RLock()
+
+    def connect(self):
+        if self.engine is None:
+            if not os.path.exists(os.path.dirname(self.db_path)):
+                os.makedirs(os.path.dirname(self.db_path))
+            self.engine = create_engine('sqlite:///' + self.db_path)
+            metadata.create_all(self.engine)
+        return self.engine
+
+    def fetch(self, instance_type, start, end):
+        if self.client is None:
+            self.client = AcsClient(ALI_CONF['accesskey_id'], ALI_CONF['accesskey_secret'], ALI_CONF['region'])
+        request = DescribeSpotPriceHistoryRequest.DescribeSpotPriceHistoryRequest()
+        request.set_NetworkType('vpc')
+        request.set_InstanceType(instance_type)
+        request.set_StartTime(start.strftime(TIME_FORMAT))
+        request.set_EndTime(end.strftime(TIME_FORMAT))
+        response = self.client.do_action_with_exception(request)
+        return json.loads(response)['SpotPrices']['SpotPriceType']
+
+    def covered(self, instance_type):
+        query = select([price_range_table.c.start, price_range_table.c.end]).\
+            where(price_range_table.c.InstanceType == instance_type)
+        return self.connect().execute(query).first()
+
+    def save(self, instance_type, prices, start, end):
+        columns = [c.name for c in spot_price_table.columns]
+        with self.connect().begin() as conn:
+            if prices:
+                rows = [{k:p.get(k) for k in columns} for p in prices]
+                conn.execute(spot_price_table.insert().prefix_with('OR REPLACE'), rows)
+            conn.execute(price_range_table.insert().prefix_with('OR REPLACE'),
+                InstanceType=instance_type, start=start, end=end)
+
+    def load(self, instance_type, start, end):
+        query = select([spot_price_table]).where(and_(
+            spot_price_table.c.InstanceType == instance_type,
+            spot_price_table.c.NetworkType == 'vpc',
+            spot_price_table.c.Timestamp >= start.strftime(TIME_FORMAT),
+            spot_price_table.c.Timestamp <= end.strftime(TIME_FORMAT))).\
+            order_by(spot_price_table.c.Timestamp, spot_price_table.c.ZoneId)
+        return [dict(row) for row in self.connect().execute(query)]
+
+    def history(self, instance_type, day=None):
+        end = datetime.datetime.utcnow()
+        if day:
+            start = end - datetime.timedelta(days=day)
+        else:
+            start = end - DEFAULT_WINDOW
+
+        with self.lock:
+            try:
+                covered = self.covered(instance_type)
+                if covered is None or covered.end < start:
+                    self.save(instance_type, self.fetch(instance_type, start, end), start, end)
+                else:
+                    (covered_start, covered_end) = covered
+                    if start < covered_start:
+                        self.save(instance_type, self.fetch(instance_type, start, covered_start), start, covered_end)
+                        covered_start = start
+                    if (end - covered_end).total_seconds() > self.ttl:
+                        self.save(instance_type, self.fetch(instance_type, covered_end, end), covered_start, end)
+            except ServerException, e:
+                print dyeFAIL(str(e) + " Instance Type: %s" % instance_type)
+                return []
+            return self.load(instance_type, start, end)
+
+    def clear(self):
+        with self.lock:
+            with self.connect().begin() as conn:
+                conn.execute(spot_price_table.delete())
+                conn.execute(price_range_table.delete())
+
+
+if ALI_CONF:
+    PRICE_CACHE = PriceCache(os.path.expanduser('~/.snap/cache/price.db'), ALI_CONF.get('price_ttl', 600))
+else:
+    PRICE_CACHE = PriceCache(os.path.expanduser('~/.snap/cache/price.db'))
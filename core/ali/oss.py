@@ -2,9 +2,14 @@ import oss2
 import os
 import time
 import hashlib
+import bisect
+import threading
+import cPickle as pickle
+from contextlib import contextmanager
 from . import ALI_CONF
 from oss2.exceptions import NoSuchKey
-from ..colorMessage import dyeWARNING, dyeFAIL
+from ..colorMessage import dyeWARNING
+from ..misc import thread_map
 
 def oss2key(destination):
     prefix = os.path.join('oss://', BUCKET.bucket_name)
@@ -35,6 +40,147 @@ class OSSkeys(object):
             raise StopIteration()
 
 
+class ObjectListing(object):
+    """Sorted keys and sizes of listed prefixes.
+
+    exists/size of any key under a listed prefix are answered by bisect
+    instead of HEAD and list requests. A listed prefix expires after `ttl`
+    seconds, prefixes listed since a hold began do not expire until it ends.
+    SNAP's own writes and deletes update the index directly.
+    """
+    def __init__(self, ttl=300):
+        super(ObjectListing, self).__init__()
+        self.ttl = ttl
+        self.keys = []
+        self.sizes = {}
+        self.listed = {}
+        self.prefixes = []
+        self.held = 0
+        self.held_since = None
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def hold(self):
+        with self.lock:
+            if not self.held:
+                self.held_since = time.time()
+            self.held += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.held -= 1
+
+    def is_fresh(self, prefix, now):
+        listed = self.listed[prefix]
+        return (self.held and listed >= self.held_since) or now - listed < self.ttl
+
+    def covers(self, key):
+        now = time.time()
+        with self.lock:
+            hi = len(self.prefixes)
+            while hi:
+                # listed prefixes of key sort before it, step back through them from the nearest one
+                idx = bisect.bisect_right(self.prefixes, key, 0, hi) - 1
+                if idx < 0:
+                    return False
+                prefix = self.prefixes[idx]
+                if key.startswith(prefix):
+                    if self.is_fresh(prefix, now):
+                        return True
+                    key = prefix[:-1]
+                else:
+                    key = os.path.commonprefix([prefix, key])
+                hi = idx
+            return False
+
+    def mark(self, prefix, listed=None):
+        with self.lock:
+            if prefix not in self.listed:
+                bisect.insort(self.prefixes, prefix)
+            self.listed[prefix] = time.time() if listed is None else listed
+
+    def unmark(self, prefix):
+        with self.lock:
+            if self.listed.pop(prefix, None) is not None:
+                del self.prefixes[bisect.bisect_left(self.prefixes, prefix)]
+
+    def span(self, prefix):
+        with self.lock:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = start
+            while end < len(self.keys) and self.keys[end].startswith(prefix):
+                end += 1
+            return start, end
+
+    def scan(self, prefix):
+        with self.lock:
+            start, end = self.span(prefix)
+            return self.keys[start:end]
+
+    def exists(self, key):
+        with self.lock:
+            idx = bisect.bisect_left(self.keys, key)
+            return idx < len(self.keys) and self.keys[idx].startswith(key)
+
+    def size(self, key):
+        with self.lock:
+            return sum([self.sizes[k] for k in self.scan(key)])
+
+    def list(self, prefixes, threads=1, refresh=False):
+        def collapse(prefixes):
+            collapsed = []
+            for prefix in sorted(set(prefixes)):
+                if not collapsed or not prefix.startswith(collapsed[-1]):
+                    collapsed.append(prefix)
+            return collapsed
+
+        prefixes = [p for p in collapse(prefixes) if refresh or not self.covers(p)]
+        thread_map(self.refresh, prefixes, threads)
+        with self.lock:
+            now = time.time()
+            for prefix in prefixes:
+                start = end = bisect.bisect_left(self.prefixes, prefix)
+                while end < len(self.prefixes) and self.prefixes[end].startswith(prefix):
+                    end += 1
+                map(self.unmark, self.prefixes[start:end])
+                self.mark(prefix, now)
+
+    def refresh(self, prefix):
+        objects = [(obj.key, obj.size) for obj in oss2.ObjectIterator(BUCKET, prefix=prefix, max_keys=1000)]
+        with self.lock:
+            self.drop(prefix)
+            self.sizes.update(objects)
+            # keys under a prefix are contiguous, splice them in instead of sorting the whole index
+            start = bisect.bisect_left(self.keys, prefix)
+            self.keys[start:start] = sorted([k for k, size in objects])
+
+    def drop(self, prefix):
+        with self.lock:
+            start, end = self.span(prefix)
+            map(self.sizes.pop, self.keys[start:end])
+            del self.keys[start:end]
+
+    def add(self, key, size):
+        with self.lock:
+            if key not in self.sizes:
+                bisect.insort(self.keys, key)
+            self.sizes[key] = size
+
+    def remove(self, keys):
+        with self.lock:
+            for key in keys:
+                if self.sizes.pop(key, None) is not None:
+                    del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def clear(self):
+        with self.lock:
+            self.keys = []
+            self.sizes = {}
+            self.listed = {}
+            self.prefixes = []
+
+
 def read_object(key, byte_range = None, warn=True, full=False):
     try:
         meta = BUCKET.get_object_meta(key)
@@ -50,54 +196,93 @@ def read_object(key, byte_range = None, warn=True, full=False):
 
     return BUCKET.get_object(key, byte_range).read()
 
-def is_object_exists(destination):
-    key = oss2key(destination)
-    return BUCKET.object_exists(key)
-
-def is_size_differ_and_newer(source, destination):
-    key = oss2key(destination)
-    meta = BUCKET.get_object_meta(key)
-    source_size = os.path.getsize(source)
-    if source_size != meta.content_length:
-        msg = 'Warning: {source}({source_size}) size differ from {destination}({destination_size})'.format(
-            source=source, source_size=source_size, destination=destination, destination_size=meta.content_length)
-        if int(time.time()) > meta.last_modified:
-            print dyeFAIL(msg)
-            return True
-        else:
-            raise ValueError(msg + ' but not newer')
-    else:
-        return False
-
-def is_source_newer(source, destination):
-    key = oss2key(destination)
-    meta = BUCKET.get_object_meta(key)
-    return int(int(os.path.getmtime(source))) > meta.last_modified
-
-def is_size_differ(source, destination):
-    key = oss2key(destination)
-    meta = BUCKET.get_object_meta(key)
-    return os.path.getsize(source) != meta.content_length
-
-def is_md5_differ(source, destination):
-    key = oss2key(destination)
-    meta = BUCKET.get_object_meta(key)
-    if '-' in meta.etag:
-        print dyeFAIL('Warnning: {destination} is a Multipart file, has no md5sum on oss.')
-        return False
-    return md5(source) != meta.etag.lower()
-
 def md5(fname):
     hash_md5 = hashlib.md5()
     with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
+class HashCache(object):
+    """MD5 of local files keyed by (device, inode, size, mtime), kept across runs in a pickle file."""
+    def __init__(self, path):
+        super(HashCache, self).__init__()
+        self.path = path
+        self.hashes = None
+        self.changed = False
+        self.lock = threading.RLock()
+
+    def load(self):
+        with self.lock:
+            if self.hashes is None:
+                self.hashes = {}
+                if os.path.exists(self.path):
+                    try:
+                        with open(self.path, 'rb') as f:
+                            self.hashes = pickle.load(f)
+                    except Exception, e:
+                        print dyeWARNING('Broken md5 cache %s: %s' % (self.path, e))
+            return self.hashes
+
+    def md5(self, fname):
+        stat = os.stat(fname)
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+        hashes = self.load()
+        if key not in hashes:
+            value = md5(fname)
+            with self.lock:
+                hashes[key] = value
+                self.changed = True
+        return hashes[key]
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp_file = '%s.%d' % (self.path, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(self.hashes, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, self.path)
+            self.changed = False
+
+def crc64(fname):
+    crc = oss2.utils.Crc64()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc.update(chunk)
+    return crc.crc
+
+def upload_file(key, filename, progress_callback=None):
+    """Upload with put_object, or resumable multipart upload if larger than multipart_threshold."""
+    store = oss2.ResumableStore(root=os.path.expanduser('~/.snap/cache'), dir='resumable')
+    return oss2.resumable_upload(BUCKET, key, filename, store=store,
+        multipart_threshold=ALI_CONF.get('multipart_threshold', oss2.defaults.multipart_threshold),
+        num_threads=ALI_CONF.get('multipart_threads', 4), progress_callback=progress_callback)
+
+def download_file(key, filename, size=None, progress_callback=None):
+    """Download with get_object, or resumable ranged download if larger than multiget_threshold.
+
+    A known `size` saves the HEAD request of small objects.
+    """
+    threshold = ALI_CONF.get('multiget_threshold', oss2.defaults.multiget_threshold)
+    if size is not None and size < threshold:
+        return BUCKET.get_object_to_file(key, filename, progress_callback=progress_callback)
+    store = oss2.ResumableDownloadStore(root=os.path.expanduser('~/.snap/cache'), dir='resumable_download')
+    return oss2.resumable_download(BUCKET, key, filename, store=store, multiget_threshold=threshold,
+        num_threads=ALI_CONF.get('multipart_threads', 4), progress_callback=progress_callback)
+
 if ALI_CONF:
+    # BUCKET's session is shared by transfer threads and their multipart threads
+    oss2.defaults.connection_pool_size = ALI_CONF.get('connection_pool_size', 64)
     endpoint = "http://oss-%s.aliyuncs.com" % ALI_CONF['region']
     AUTH = oss2.Auth(ALI_CONF['accesskey_id'], ALI_CONF['accesskey_secret'])
     BUCKET = oss2.Bucket(AUTH, endpoint, ALI_CONF['bucket'])
+    LISTING = ObjectListing(ALI_CONF.get('listing_ttl', 300))
 else:
     AUTH = None
     BUCKET = None
+    LISTING = ObjectListing()
+
+HASH_CACHE = HashCache(os.path.expanduser('~/.snap/cache/md5.pkl'))
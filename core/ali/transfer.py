@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import threading
+from multiprocessing.dummy import Pool as ThreadPool
+from .oss import LISTING, download_file, upload_file
+from ..colorMessage import dyeFAIL
+from ..misc import human_size
+
+
+class Transfer(object):
+    """Copy files between local disk and OSS in a pool of threads.
+
+    Copies are queued by `download` and `upload`, then run together by `run`
+    with one progress bar for all of them. Objects above the multipart
+    threshold are copied in parts, with checkpoints under ~/.snap/cache, so an
+    interrupted copy resumes from the finished parts.
+    """
+    def __init__(self, threads=10):
+        super(Transfer, self).__init__()
+        self.threads = threads
+        self.jobs = []
+        self.sizes = {}
+        self.consumed = {}
+        self.done = 0
+        self.failed = []
+        self.start = None
+        self.shown = 0
+        self.lock = threading.Lock()
+
+    def download(self, key, filename, size=None):
+        self.add(('download', key, filename), size)
+
+    def upload(self, filename, key, size=None):
+        if size is None:
+            size = os.path.getsize(filename)
+        self.add(('upload', filename, key), size)
+
+    def add(self, job, size):
+        self.jobs.append(job)
+        self.sizes[job] = size
+        self.consumed[job] = 0
+
+    def callback(self, job):
+        def update(consumed, total):
+            with self.lock:
+                self.consumed[job] = consumed
+                if total:
+                    self.sizes[job] = total
+            self.show_progress()
+        return update
+
+    def show_progress(self, force=False):
+        now = time.time()
+        if not force and now - self.shown < 0.5:
+            return
+        with self.lock:
+            self.shown = now
+            consumed = sum(self.consumed.values())
+            total = sum([s for s in self.sizes.values() if s])
+            done = self.done
+        speed = consumed / max(now - self.start, 0.001)
+        sys.stdout.write("\r{done}/{files} files, {consumed}/{total}, {speed}/s    ".format(
+            done=done, files=len(self.jobs), consumed=human_size(consumed), total=human_size(total), speed=human_size(speed)))
+        sys.stdout.flush()
+
+    def transfer(self, job):
+        (direction, source, destination) = job
+        try:
+            if direction == 'download':
+                folder = os.path.dirname(destination)
+                if folder and not os.path.exists(folder):
+                    try:
+                        os.makedirs(folder)
+                    except OSError:
+                        if not os.path.isdir(folder):
+                            raise
+                download_file(source, destination, self.sizes[job], self.callback(job))
+            else:
+                upload_file(destination, source, self.callback(job))
+                if LISTING.covers(destination):
+                    LISTING.add(destination, os.path.getsize(source))
+        except Exception, e:
+            with self.lock:
+                self.failed.append((job, e))
+                self.consumed[job] = 0
+        else:
+            with self.lock:
+                self.consumed[job] = self.sizes[job] or self.consumed[job]
+        with self.lock:
+            self.done += 1
+        self.show_progress()
+
+    def run(self):
+        """Run the queued copies, return the (job, exception) of failed ones."""
+        if not self.jobs:
+            return []
+        self.start = time.time()
+        pool = ThreadPool(min(self.threads, len(self.jobs)))
+        try:
+            pool.map(self.transfer, self.jobs)
+            pool.close()
+        finally:
+            pool.terminate()
+        self.show_progress(force=True)
+        print
+        for (direction, source, destination), e in self.failed:
+            print dyeFAIL("Failed to {direction} {source} => {destination}: {e}".format(
+                direction=direction, source=source, destination=destination, e=e))
+        failed = self.failed
+        self.jobs = []
+        self.sizes = {}
+        self.consumed = {}
+        self.done = 0
+        self.failed = []
+        return failed
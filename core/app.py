@@ -7,6 +7,8 @@ import pdb
 import sys
 import errno
 import copy
+import threading
+from collections import OrderedDict
 from jinja2 import Template
 from customizedYAML import folded_unicode, literal_unicode, include_constructor
 from colorMessage import dyeWARNING, dyeFAIL
@@ -15,6 +17,32 @@ from core import models
 from core.misc import *
 from core.formats import *
 
+TEMPLATE_CACHE_SIZE = 1024
+TEMPLATE_CACHE = OrderedDict()
+TEMPLATE_LOCK = threading.Lock()
+
+def compile_template(source):
+    """Compiled jinja templates are shared by all Apps, least recently used ones are dropped."""
+    with TEMPLATE_LOCK:
+        template = TEMPLATE_CACHE.pop(source, None)
+        if template is None:
+            template = Template(source)
+            if len(TEMPLATE_CACHE) >= TEMPLATE_CACHE_SIZE:
+                TEMPLATE_CACHE.popitem(last=False)
+        TEMPLATE_CACHE[source] = template
+    return template
+
+def is_plain_text(source):
+    return not any([mark in source for mark in ('{{', '{%', '{#', '\r')])
+
+def render_template(source, **kwargs):
+    if is_plain_text(source):
+        # same as what jinja renders for text without any tag
+        if source.endswith('\n'):
+            source = source[:-1]
+        return unicode(source)
+    return compile_template(source).render(**kwargs)
+
 
 class AppParameter(dict):
     """AppParameter"""
@@ -669,8 +697,7 @@ class App(dict):
             outputs = self.get('outputs')
         samples = self.parameters.get('Samples')
         groups = self.parameters.get('Groups')
-        template = Template(cmd_template)
-        return template.render(
+        return render_template(cmd_template,
             inputs = inputs,
             outputs = outputs,
             parameters = parameters,
@@ -974,7 +1001,7 @@ class App(dict):
     def test(self):
         pass
 
-    def run(self, cpu=None, mem=None, instance=None, disk_type=None, disk_size=None, docker_image=None, cluster=None, all=False, upload=True, show_json=False, discount=None, **kwargs):
+    def run(self, cpu=None, mem=None, instance=None, disk_type=None, disk_size=None, docker_image=None, cluster=None, all=False, upload=True, show_json=False, discount=None, threads=10, **kwargs):
         def update_app(cpu, mem, disk_type, disk_size, instance, docker_image):
             def update_config(conf, name, value):
                 if value:
@@ -1005,7 +1032,7 @@ class App(dict):
                 parameters = self.parameters.copy(),
                 dependencies = self.dependencies)
             db.format()
-            db.mkOSSuploadSH()
+            db.mkOSSuploadSH(threads)
             return db
 
         def upload_scripts():
@@ -2,6 +2,9 @@ import yaml
 import os
 import re
 import pdb
+import copy
+import hashlib
+import cPickle as pickle
 from collections import OrderedDict
 
 # codes form stackoverflow.com
@@ -40,9 +43,77 @@ def include_constructor(loader, node):
         stream_dirname = os.path.dirname(stream_filename)
         filename = os.path.join(stream_dirname, filename)
 
-    with open(filename) as f:
-        data = yaml.load(f)
-    return data
+    return load_include(filename)
+
+INCLUDE_CACHE = {}
+INCLUDE_CACHE_DIR = None
+INCLUDE_STACK = []
+
+def enable_include_cache(cache_dir=os.path.expanduser('~/.snap/cache/include')):
+    global INCLUDE_CACHE_DIR
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    INCLUDE_CACHE_DIR = cache_dir
+
+def include_key(path):
+    stat = os.stat(path)
+    return (path, stat.st_mtime, stat.st_size)
+
+def is_include_fresh(entry):
+    (key, depends, data) = entry
+    try:
+        return all([include_key(k[0]) == k for k in [key] + depends])
+    except OSError:
+        return False
+
+def load_include(filename):
+    """Included files are parsed once per (realpath, mtime, size), every caller gets its own copy."""
+    path = os.path.realpath(filename)
+    entry = INCLUDE_CACHE.get(path)
+    if entry is None or not is_include_fresh(entry):
+        entry = load_include_pickle(path)
+    if entry is None or not is_include_fresh(entry):
+        entry = parse_include(path)
+        dump_include_pickle(path, entry)
+    INCLUDE_CACHE[path] = entry
+
+    # files including this one depend on what it includes too
+    if INCLUDE_STACK:
+        INCLUDE_STACK[-1].extend([entry[0]] + entry[1])
+    return copy.deepcopy(entry[2])
+
+def parse_include(path):
+    key = include_key(path)
+    INCLUDE_STACK.append([])
+    try:
+        with open(path) as f:
+            data = yaml.load(f)
+    finally:
+        depends = INCLUDE_STACK.pop()
+    return (key, depends, data)
+
+def include_pickle(path):
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return os.path.join(INCLUDE_CACHE_DIR, hashlib.md5(path).hexdigest() + '.pkl')
+
+def load_include_pickle(path):
+    if INCLUDE_CACHE_DIR is None or not os.path.exists(include_pickle(path)):
+        return None
+    try:
+        with open(include_pickle(path), 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def dump_include_pickle(path, entry):
+    if INCLUDE_CACHE_DIR is None:
+        return
+    pickle_file = include_pickle(path)
+    tmp_file = '%s.%d' % (pickle_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, pickle_file)
 
 yaml.add_constructor(u'!include', include_constructor)
 
@@ -61,23 +132,60 @@ yaml.add_constructor(u'!range', range_constructor)
 yaml.add_implicit_resolver(u'!range', range_regex)
 
 
+class Refer(object):
+    """Placeholder of a !refer node, resolved after the whole document is constructed."""
+    def __init__(self, path):
+        self.path = path
+        self.keys = path.split('.')
+
 def refer_constructor(loader, node):
-    def getRefer(content, keys):
-        content = content.replace('!refer ', '')
-        ref = yaml.load(content)
-        for k in keys:
+    loader.has_refer = True
+    return Refer(loader.construct_scalar(node))
+
+def resolve_refers(document):
+    def resolve(refer, chain):
+        if refer.path in chain:
+            raise ValueError('Circular !refer: %s' % ' -> '.join(chain + [refer.path]))
+        ref = document
+        for k in refer.keys:
             ref = ref.get(k)
-        return ref
-
-    data = loader.construct_scalar(node)
-    keys = data.split('.')
-    offset = loader.stream.tell()
-    loader.stream.seek(0)
-    content = loader.stream.read()
-    loader.stream.seek(offset)
-    refer = getRefer(content, keys)
-    return refer
+        return copy.deepcopy(walk(ref, chain + [refer.path]))
+
+    def walk(data, chain):
+        if isinstance(data, Refer):
+            return resolve(data, chain)
+        if not isinstance(data, (dict, list)) or id(data) in resolved:
+            return data
+        if id(data) in resolving:
+            # a !refer pointing to the node containing it
+            if chain:
+                raise ValueError('Circular !refer: %s' % ' -> '.join(chain))
+            return data
+
+        resolving.add(id(data))
+        if isinstance(data, dict):
+            for k, v in data.items():
+                data[k] = walk(v, chain)
+        else:
+            for i, v in enumerate(data):
+                data[i] = walk(v, chain)
+        resolving.discard(id(data))
+        resolved.add(id(data))
+        return data
+
+    resolving = set()
+    resolved = set()
+    return walk(document, [])
+
+def construct_document(loader, node):
+    loader.has_refer = False
+    data = construct_base_document(loader, node)
+    if loader.has_refer:
+        data = resolve_refers(data)
+    return data
 
+construct_base_document = yaml.Loader.construct_document
+yaml.Loader.construct_document = construct_document
 yaml.add_constructor(u'!refer', refer_constructor)
 
 def mapping_constructor(loader, node):
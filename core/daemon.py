@@ -0,0 +1,149 @@
+import os
+import time
+import logging
+import signal
+import traceback
+from core import models
+from core.misc import *
+from colorMessage import dyeWARNING, dyeFAIL, dyeOKBLUE
+from sqlalchemy.orm import sessionmaker
+
+
+class ProjectSyncer(object):
+    """Keep one project loaded and sync it every `interval` minutes."""
+    def __init__(self, name, dbfile, interval=15):
+        super(ProjectSyncer, self).__init__()
+        self.name = name
+        self.dbfile = dbfile
+        self.interval = interval
+        self.engine = models.new_engine(dbfile)
+        self.Session = sessionmaker(bind=self.engine)
+        self.session = None
+        self.proj = None
+        self.mtime = None
+        self.next_run = time.time()
+        # one handler for the life of the syncer, a new one on each reload would leak its file
+        self.log_handler = new_log_file_handler(dbfile)
+
+    def __repr__(self):
+        return "<ProjectSyncer(name={name}, interval={interval})>".format(name=self.name, interval=self.interval)
+
+    def is_changed(self):
+        return self.mtime != os.path.getmtime(self.dbfile)
+
+    def load(self):
+        self.proj = None
+        if self.session:
+            self.session.close()
+        self.session = self.Session()
+        self.proj = self.session.query(models.Project).filter_by(name = self.name).one()
+        self.proj.session = self.session
+        self.proj.logger = new_logger(self.name, self.log_handler)
+        self.mtime = os.path.getmtime(self.dbfile)
+
+    def sync(self):
+        try:
+            # a project that fails to load waits for the next run like a failed sync
+            if self.proj is None or self.is_changed():
+                self.load()
+            self.proj.sync()
+            # end the read transaction, do not hold the lock until next sync
+            self.session.commit()
+        except:
+            # Project.sync releases the lock it took, never remove a lock held by another process
+            if self.session:
+                self.session.rollback()
+            # the scheduler kept in memory still has the rolled back transitions
+            if self.proj is not None:
+                self.proj.scheduler = None
+            raise
+        finally:
+            self.next_run = time.time() + self.interval * 60
+            # our own commits should not trigger a reload, a missing snap.db fails the next sync instead
+            if os.path.exists(self.dbfile):
+                self.mtime = os.path.getmtime(self.dbfile)
+
+    def close(self):
+        if self.session:
+            self.session.close()
+        self.engine.dispose()
+        logging.getLogger(self.name).removeHandler(self.log_handler)
+        self.log_handler.close()
+
+
+class SyncDaemon(object):
+    """Sync projects recorded in ~/.snap/db.yaml in one long-running process."""
+    def __init__(self, db_yaml, projects=None, interval=15, max_sleep=60):
+        super(SyncDaemon, self).__init__()
+        self.db_yaml = db_yaml
+        self.projects = projects or {}
+        self.interval = interval
+        self.max_sleep = max_sleep
+        self.syncers = {}
+        self.db_mtime = None
+        self.running = False
+        self.logger = new_logger('snap-daemon')
+
+    def refresh(self):
+        mtime = os.path.getmtime(self.db_yaml)
+        if mtime == self.db_mtime:
+            return
+        db = loadYaml(self.db_yaml) or {}
+        if self.projects:
+            names = self.projects.keys()
+        else:
+            names = db.keys()
+
+        for name in set(self.syncers.keys()) - set(names):
+            self.syncers.pop(name).close()
+        for name in names:
+            if name not in db:
+                print dyeWARNING("Project %s not found in %s" % (name, self.db_yaml))
+                continue
+            syncer = self.syncers.get(name)
+            if syncer is None or syncer.dbfile != db[name]:
+                if syncer:
+                    syncer.close()
+                interval = self.projects.get(name) or self.interval
+                self.syncers[name] = ProjectSyncer(name, db[name], interval)
+        self.db_mtime = mtime
+
+    def sync_each(self, syncer):
+        self.logger.info("syncing %s" % syncer.name)
+        try:
+            syncer.sync()
+        except Exception, e:
+            print dyeFAIL("{name}: {error}".format(name=syncer.name, error=e))
+            self.logger.error(traceback.format_exc())
+
+    def next_sleep(self):
+        if not self.syncers:
+            return self.max_sleep
+        next_run = min([s.next_run for s in self.syncers.values()])
+        return max(0, min(next_run - time.time(), self.max_sleep))
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.running = True
+        print dyeOKBLUE("snap daemon started, pid: %s" % os.getpid())
+        while self.running:
+            try:
+                self.refresh()
+            except Exception, e:
+                # db.yaml might be missing or half written, keep syncing the projects loaded before
+                print dyeFAIL("{db_yaml}: {error}".format(db_yaml=self.db_yaml, error=e))
+                self.logger.error(traceback.format_exc())
+            now = time.time()
+            due = sorted([s for s in self.syncers.values() if s.next_run <= now], key=lambda x:x.next_run)
+            for syncer in due:
+                if not self.running:
+                    break
+                self.sync_each(syncer)
+            if self.running:
+                time.sleep(self.next_sleep())
+        map(lambda x:x.close(), self.syncers.values())
+        print dyeOKBLUE("snap daemon stopped.")
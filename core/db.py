@@ -2,13 +2,17 @@ import os
 import pdb
 import functools
 import glob
+import time
+import bisect
+from oss2 import ObjectIterator
 from core import models
-from core.ali.oss import BUCKET, oss2key, is_object_exists, is_size_differ_and_newer, is_source_newer, is_md5_differ
+from core.ali.oss import BUCKET, HASH_CACHE, oss2key
 from core.misc import *
 from colorMessage import dyeWARNING, dyeFAIL
 from sqlalchemy import create_engine, UniqueConstraint
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import IntegrityError
+from collections import OrderedDict, defaultdict
 
 class DB(object):
     def __init__(self, db_path, pipe_path, apps, parameters, dependencies, overwrite=False):
@@ -22,6 +26,7 @@ class DB(object):
         self.dependencies = dependencies
         self.engine = create_engine('sqlite:///{db_path}'.format(db_path=self.db_path))
         self.proj = None
+        self.task_rows = []
         if overwrite and os.path.exists(self.db_path):
             os.remove(self.db_path)
         if not os.path.exists(self.db_path):
@@ -37,6 +42,7 @@ class DB(object):
         self.mkProj()
         self.mkInstance()
         map(self.mkModule, self.modules.keys())
+        self.mkTasks()
         if self.db_path != ':memory:':
             self.mkDepends()
         self.session.commit()
@@ -104,45 +110,19 @@ class DB(object):
 
     def mkApp(self, app, module):
         def mkTask(script):
-            def mkMapping(mapping):
-                m = models.Mapping(
-                    name = mapping['name'],
-                    source = mapping['source'],
-                    destination = mapping['destination'],
-                    is_write = mapping['is_write'],
-                    is_immediate = mapping['is_immediate'],
-                    is_required = mapping['is_required'])
-                try:
-                    self.session.add(m)
-                    self.session.commit()
-                except IntegrityError:
-                    self.session.rollback()
-                    m = self.session.query(models.Mapping).filter_by(
-                        name = mapping['name'],
-                        source = mapping['source'],
-                        destination = mapping['destination'],
-                        is_write = mapping['is_write'],
-                        is_immediate = mapping['is_immediate']).one()
-                return m
-
-            script['task'] = models.Task(
-                    shell = os.path.abspath(script['filename']),
-                    cpu = cpu,
-                    mem = unifyUnit(mem),
-                    docker_image = app.docker_image,
-                    disk_size = unifyUnit(disk_size),
-                    disk_type = disk_type,
-                    project = self.proj,
-                    module = module,
-                    app = app,
-                    mapping = map(mkMapping, script['mappings']),
-                    instance = instance)
-            try:
-                self.session.add(script['task'])
-                self.session.commit()
-            except IntegrityError:
-                self.session.rollback()
-                print dyeWARNING("'{sh}' not unique".format(sh=script['filename']))
+            task = dict(
+                shell = os.path.abspath(script['filename']),
+                aasm_state = 'created',
+                cpu = cpu,
+                mem = unifyUnit(mem),
+                docker_image = app.docker_image,
+                disk_size = unifyUnit(disk_size),
+                disk_type = disk_type,
+                project_id = self.proj.id,
+                module_id = module.id,
+                app_id = app.id,
+                instance_id = instance.id)
+            self.task_rows.append((script, task))
 
         mem = getAppConfig(app, ['requirements', 'resources', 'mem'])
         (cpu, mem, disk_size, disk_type) = map(functools.partial(getResourceConfig, app=app), ['cpu', 'mem', 'disk', 'disk_type'])
@@ -166,41 +146,87 @@ class DB(object):
 
         map(mkTask, scripts)
 
+    def mkTasks(self):
+        def mappingKey(mapping):
+            return tuple([mapping[k] for k in mapping_keys])
+
+        def loadMappingIds():
+            columns = [models.Mapping.id] + [getattr(models.Mapping, k) for k in mapping_keys]
+            return {tuple(row[1:]): row[0] for row in self.session.query(*columns)}
+
+        def loadTaskIds():
+            return dict(self.session.query(models.Task.shell, models.Task.id).filter_by(project_id = self.proj.id))
+
+        def bulkInsert(table, rows):
+            if rows:
+                self.session.execute(table.insert(), rows)
+
+        mapping_keys = ('name', 'source', 'destination', 'is_write', 'is_immediate')
+        mapping_ids = loadMappingIds()
+        new_mappings = OrderedDict()
+        for script, task in self.task_rows:
+            for mapping in script['mappings']:
+                key = mappingKey(mapping)
+                if key not in mapping_ids and key not in new_mappings:
+                    new_mappings[key] = {k:mapping[k] for k in mapping_keys + ('is_required', )}
+        bulkInsert(models.Mapping.__table__, new_mappings.values())
+
+        task_ids = loadTaskIds()
+        new_tasks = OrderedDict()
+        for script, task in self.task_rows:
+            if task['shell'] in task_ids or task['shell'] in new_tasks:
+                print dyeWARNING("'{sh}' not unique".format(sh=script['filename']))
+            else:
+                new_tasks[task['shell']] = (script, task)
+        bulkInsert(models.Task.__table__, [task for script, task in new_tasks.values()])
+
+        mapping_ids = loadMappingIds()
+        task_ids = loadTaskIds()
+        task_mappings = OrderedDict()
+        for script, task in new_tasks.values():
+            for mapping in script['mappings']:
+                task_mappings[(task_ids[task['shell']], mapping_ids[mappingKey(mapping)])] = True
+        bulkInsert(models.task_mapping_table, [{'task_id': t, 'mapping_id': m} for t, m in task_mappings.keys()])
+        self.session.commit()
+
+        tasks = {t.shell: t for t in self.session.query(models.Task).filter_by(project_id = self.proj.id)}
+        for script, task in self.task_rows:
+            script['task'] = tasks[task['shell']]
+        print "{tasks} tasks, {mappings} mappings added.".format(tasks=len(new_tasks), mappings=len(new_mappings))
+
     def mkDepends(self):
         def mkCombTaskDepends(tasks, dep_tasks):
-            for task in tasks:
-                for dep_task in dep_tasks:
-                    task.depend_on.append(dep_task)
-            self.session.commit()
+            edges.update([(task, dep_task) for task in tasks for dep_task in dep_tasks])
 
-        def mkSampleTaskDepends(app, module, dep_app, dep_module):
+        def mkSampleTaskDepends(appname, module, dep_appname, dep_module):
             def mkEachSampleTaskDepends(sample_name):
-                tasks = getSampleTask(app, module, sample_name)
-                dep_tasks = getSampleTask(dep_app, dep_module, sample_name)
+                tasks = sample_tasks[(module, appname, sample_name)]
+                dep_tasks = sample_tasks[(dep_module, dep_appname, sample_name)]
                 mkCombTaskDepends(tasks, dep_tasks)
 
             map(mkEachSampleTaskDepends, [sample['sample_name'] for sample in self.parameters['Samples']])
 
-        def mkAppDepends(app, module_name, depends):
-            for dep_appname in depends[app.name]['depends']:
+        def mkAppDepends(appname, module_name, depends):
+            for dep_appname in depends[appname]['depends']:
                 if dep_appname not in apps_in_param:
-                    print dyeWARNING("{appname}: skipping dependence app {dep_appname} since it's not in parameters.conf".format(appname=app.name, dep_appname=dep_appname))
+                    print dyeWARNING("{appname}: skipping dependence app {dep_appname} since it's not in parameters.conf".format(appname=appname, dep_appname=dep_appname))
                     continue
 
                 if dep_appname in depends:
                     dep_module_name = module_name
-                    dep_module = self.session.query(models.Module).filter_by(name = dep_module_name).one()
-                    dep_app = self.session.query(models.App).filter_by(name = dep_appname).filter_by(module_id = dep_module.id).one()
                 else:
                     dep_module_name = getDepModule(dep_appname)
-                    dep_module = self.session.query(models.Module).filter_by(name = dep_module_name).one()
-                    dep_app = self.session.query(models.App).filter_by(name = dep_appname).filter_by(module_id = dep_module.id).one()
 
-                if hasSampleName(module_name, app.name) and hasSampleName(dep_module_name, dep_app.name):
-                    mkSampleTaskDepends(app, module_name, dep_app, dep_module_name)
+                if dep_appname not in module_apps[dep_module_name]:
+                    msg = '{dep_appname} not found in module {module}'.format(dep_appname=dep_appname, module=dep_module_name)
+                    print dyeFAIL(msg)
+                    raise KeyError(msg)
+
+                if hasSampleName(module_name, appname) and hasSampleName(dep_module_name, dep_appname):
+                    mkSampleTaskDepends(appname, module_name, dep_appname, dep_module_name)
                 else:
-                    tasks = getModuleAppTask(app, module_name)
-                    dep_tasks = getModuleAppTask(dep_app, dep_module_name)
+                    tasks = app_tasks[(module_name, appname)]
+                    dep_tasks = app_tasks[(dep_module_name, dep_appname)]
                     mkCombTaskDepends(tasks, dep_tasks)
 
         def getDepModule(dep_appname):
@@ -220,70 +246,142 @@ class DB(object):
         def hasSampleName(module, appname):
             return self.dependencies[module][appname]['sh_file'].count('sample_name}}') > 0
 
-        def getModuleAppTask(app, module):
-            return [t for t in app.task if t.module.name == module]
-
-        def getSampleTask(app, module, sample_name):
-            return [s['task'] for s in self.apps[app.name].scripts if s['task'].module.name == module and s['extra']['sample_name'] == sample_name]
+        def indexModuleApps():
+            module_apps = defaultdict(set)
+            q = self.session.query(models.Module.name, models.App.name).join(models.App, models.App.module_id == models.Module.id)
+            for module_name, appname in q:
+                module_apps[module_name].add(appname)
+            return module_apps
+
+        def indexAppTasks():
+            app_tasks = defaultdict(list)
+            q = self.session.query(models.Module.name, models.App.name, models.Task.id). \
+                join(models.Task, models.Task.module_id == models.Module.id). \
+                join(models.App, models.Task.app_id == models.App.id). \
+                filter(models.Task.project_id == self.proj.id)
+            for module_name, appname, task_id in q:
+                app_tasks[(module_name, appname)].append(task_id)
+            return app_tasks
+
+        def indexSampleTasks():
+            sample_tasks = defaultdict(list)
+            for appname, app in self.apps.iteritems():
+                for script in app.scripts:
+                    if script.get('task') is None or not script.get('extra') or 'sample_name' not in script['extra']:
+                        continue
+                    key = (script['module'], appname, script['extra']['sample_name'])
+                    sample_tasks[key].append(script['task'].id)
+            return sample_tasks
 
         def mkModuleDepend(name, depends):
-            module = self.session.query(models.Module).filter_by(name = name).one()
-            for app in module.app:
-                mkAppDepends(app, module.name, depends)
+            for appname in module_apps[name]:
+                mkAppDepends(appname, name, depends)
 
+        start = time.time()
         apps_in_param = reduce(concat, [apps.keys() for apps in self.modules.values()])
+        module_apps = indexModuleApps()
+        app_tasks = indexAppTasks()
+        sample_tasks = indexSampleTasks()
+        edges = set()
 
         for name in self.modules.keys():
             mkModuleDepend(name, self.dependencies[name])
 
-    def mkOSSuploadSH(self):
+        edges.difference_update(self.session.query(models.dependence_table.c.task_id, models.dependence_table.c.depend_task_id).all())
+        if edges:
+            self.session.execute(models.dependence_table.insert(), [{'task_id': t, 'depend_task_id': d} for t, d in sorted(edges)])
+        self.session.commit()
+        print "{edges} dependencies built in {seconds:.2f}s.".format(edges=len(edges), seconds=time.time() - start)
+
+    def mkOSSuploadSH(self, threads=10):
+        def get_folder(destination):
+            key = oss2key(destination)
+            # a key at the bucket root is listed by its own name, not the whole bucket
+            return key[:key.rfind('/') + 1] or key
+
+        def list_folder(folder):
+            return [(obj.key, obj) for obj in ObjectIterator(BUCKET, prefix=folder, max_keys=1000)]
+
+        def is_remote_exists(destination):
+            key = oss2key(destination)
+            idx = bisect.bisect_left(remote_keys, key)
+            return idx < len(remote_keys) and remote_keys[idx].startswith(key)
+
+        def need_md5(source, destination):
+            obj = remote.get(oss2key(destination))
+            return obj is not None and os.path.getsize(source) == obj.size and \
+                int(os.path.getmtime(source)) > obj.last_modified and '-' not in obj.etag
+
         def addSource(source, destination):
             if source in file_size:
                 return
-            if not is_object_exists(destination):
+            obj = remote.get(oss2key(destination))
+            if obj is None:
                 file_size[source] = os.path.getsize(source)
                 cmd.append("ossutil cp -f %s %s" % (source, destination))
-            elif is_size_differ_and_newer(source, destination):
-                cmd.append("ossutil cp -f %s %s" % (source, destination))
-            elif is_source_newer(source, destination) and is_md5_differ(source, destination):
+            elif os.path.getsize(source) != obj.size:
+                msg = 'Warning: {source}({source_size}) size differ from {destination}({destination_size})'.format(
+                    source=source, source_size=os.path.getsize(source), destination=destination, destination_size=obj.size)
+                print dyeFAIL(msg)
                 cmd.append("ossutil cp -f %s %s" % (source, destination))
+            elif int(os.path.getmtime(source)) > obj.last_modified:
+                if '-' in obj.etag:
+                    print dyeFAIL('Warnning: {destination} is a Multipart file, has no md5sum on oss.'.format(destination=destination))
+                elif hashes[source] != obj.etag.lower():
+                    cmd.append("ossutil cp -f %s %s" % (source, destination))
 
         def tryAddSourceWithPrefix(source, destination):
             for each_source in glob.glob(source+'*'):
                 each_destination = os.path.join(os.path.dirname(destination), os.path.basename(each_source))
-                addSource(each_source, each_destination)
-
-        def mkDataUpload():
-            for m in self.session.query(models.Mapping). \
-                    filter_by(is_write = 0, is_immediate = 0). \
-                    filter(models.Mapping.name != 'sh').all():
-               if os.path.exists(m.source):
-                   addSource(m.source, m.destination)
-               else:
-                   if not m.exists():
-                       msg = "{name}:{source} not exist.".format(name = m.name, source = m.source)
-                       print dyeFAIL(msg)
-                       tryAddSourceWithPrefix(m.source, m.destination)
+                pairs.append((each_source, each_destination))
 
+        def mkDataUpload(data_pairs):
+            map(lambda x: addSource(*x), data_pairs)
             content = "\n".join(['set -ex'] + list(set(cmd)))
             print "uploadData2OSS.sh: %d files(%d GB) to upload" % (len(file_size), sum(file_size.values())/2**30)
             script_file = os.path.join(self.proj_path, 'uploadData2OSS.sh')
             write(script_file, content)
 
-        def mkScriptUpload():
-            for m in self.session.query(models.Mapping).filter_by(name = 'sh').all():
-                addSource(m.source, m.destination)
-
+        def mkScriptUpload(script_pairs):
+            map(lambda x: addSource(*x), script_pairs)
             content = "\n".join(['set -ex'] + list(set(cmd)))
             print "uploadScripts2OSS.sh: %d files to upload" % len(cmd)
             script_file = os.path.join(self.proj_path, 'uploadScript2OSS.sh')
             write(script_file, content)
 
+        data_mappings = self.session.query(models.Mapping). \
+            filter_by(is_write = 0, is_immediate = 0). \
+            filter(models.Mapping.name != 'sh').all()
+        script_mappings = self.session.query(models.Mapping).filter_by(name = 'sh').all()
+
+        # one listing of every destination folder answers existence, size, mtime and md5 of all mappings
+        folders = []
+        for folder in sorted(set([get_folder(m.destination) for m in data_mappings + script_mappings])):
+            if folder and not (folders and folder.startswith(folders[-1])):
+                folders.append(folder)
+        remote = dict(sum(thread_map(list_folder, folders, threads), []))
+        remote_keys = sorted(remote)
+
+        pairs = []
+        for m in data_mappings:
+            if os.path.exists(m.source):
+                pairs.append((m.source, m.destination))
+            elif not is_remote_exists(m.destination):
+                msg = "{name}:{source} not exist.".format(name = m.name, source = m.source)
+                print dyeFAIL(msg)
+                tryAddSourceWithPrefix(m.source, m.destination)
+        data_pairs = pairs
+        script_pairs = [(m.source, m.destination) for m in script_mappings]
+
+        to_hash = list(set([s for s, d in data_pairs + script_pairs if need_md5(s, d)]))
+        hashes = dict(zip(to_hash, thread_map(HASH_CACHE.md5, to_hash, threads)))
+        HASH_CACHE.save()
+
         cmd = []
         file_size = {}
-        mkDataUpload()
+        mkDataUpload(data_pairs)
         cmd = []
-        mkScriptUpload()
+        mkScriptUpload(script_pairs)
 
     def mkOssSyncSH(self):
         def mkDataSync():
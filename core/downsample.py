@@ -0,0 +1,117 @@
+import re
+import json
+import numpy as np
+
+AGGREGATIONS = ['lttb', 'mean', 'min', 'max']
+
+
+def as_number(x):
+    x = np.asarray(x)
+    if x.dtype.kind in 'mM':
+        return x.view('int64').astype(float)
+    return x.astype(float)
+
+
+def bucket_starts(x, n_bucket):
+    """Index of the first point of each non-empty, equal width bucket of sorted x."""
+    x = as_number(x)
+    span = x[-1] - x[0]
+    if span <= 0:
+        return np.array([0])
+    buckets = np.minimum(((x - x[0]) / span * n_bucket).astype(int), n_bucket - 1)
+    return np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+
+def aggregate(x, y, n_bucket, how='mean'):
+    """Aggregate y of sorted x by min, max or mean into at most n_bucket buckets.
+
+    The x of a bucket is its first x, NaN in y is ignored.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= n_bucket:
+        return x, y
+    starts = bucket_starts(x, n_bucket)
+    valid = ~np.isnan(y)
+    counts = np.add.reduceat(valid.astype(int), starts)
+    if how == 'min':
+        values = np.fmin.reduceat(y, starts)
+    elif how == 'max':
+        values = np.fmax.reduceat(y, starts)
+    elif how == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = np.add.reduceat(np.where(valid, y, 0), starts) / counts
+    else:
+        raise ValueError('unknown aggregation %s' % how)
+    values[counts == 0] = np.nan
+    return x[starts], values
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets, keep n_out points of sorted x that preserve the shape of y."""
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    valid = ~np.isnan(y)
+    if not valid.all():
+        x = x[valid]
+        y = y[valid]
+    if len(x) <= n_out or n_out < 3:
+        return x, y
+
+    xs = as_number(x)
+    edges = np.linspace(1, len(x) - 1, n_out - 1).astype(int)
+    picked = [0]
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = xs[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = xs[-1], y[-1]
+        prev = picked[-1]
+        areas = np.abs(
+            (xs[prev] - next_x) * (y[start:end] - y[prev]) -
+            (xs[prev] - xs[start:end]) * (next_y - y[prev]))
+        picked.append(start + int(areas.argmax()))
+    picked.append(len(x) - 1)
+    return x[picked], y[picked]
+
+
+def downsample(x, y, n_out, how='lttb'):
+    if how == 'lttb':
+        return lttb(x, y, n_out)
+    return aggregate(x, y, n_out, how)
+
+
+def merge_intervals(intervals, resolution):
+    """Merge (start, finish) intervals that overlap or are closer than resolution."""
+    merged = []
+    for start, finish in sorted(intervals):
+        if merged and start - merged[-1][1] <= resolution:
+            merged[-1][1] = max(merged[-1][1], finish)
+        else:
+            merged.append([start, finish])
+    return [tuple(i) for i in merged]
+
+
+def zoom_range(relayout_data):
+    """Return the (start, end) of the zoomed x axis in plotly relayoutData, None if not zoomed."""
+    relayout_data = relayout_data or {}
+    for key in sorted(relayout_data):
+        if re.match(r'xaxis\d*\.range\[0\]$', key):
+            return relayout_data[key], relayout_data[key.replace('[0]', '[1]')]
+        if re.match(r'xaxis\d*\.range$', key):
+            return tuple(relayout_data[key])
+    return None
+
+
+def zoom_owner(selection, relayout_data):
+    """Record the relayoutData a graph holds when its selection changes, kept by the page in a hidden div."""
+    return json.dumps({'selection': selection, 'relayout': relayout_data})
+
+
+def selection_zoom(relayout_data, owner):
+    """Return zoom_range of relayoutData, None if it is left over from before the selection recorded in `owner`."""
+    if owner and relayout_data == json.loads(owner)['relayout']:
+        return None
+    return zoom_range(relayout_data)
@@ -5,7 +5,8 @@ from core import models
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import IntegrityError
-from collections import defaultdict
+from sqlalchemy import literal_column
+from collections import defaultdict, namedtuple, OrderedDict
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table_experiments as dt
@@ -19,11 +20,13 @@ import plotly
 import os
 import pdb
 import itertools
+from core.downsample import merge_intervals, zoom_owner, selection_zoom
 
 db = loadYaml(os.path.expanduser("~/.snap/db.yaml"))
 app = dash.Dash()
 
 app.scripts.config.serve_locally = True
+GANTT_RESOLUTION = 2000
 ctrl_style = {'width': '25%', 'display': 'inline-block', 'margin': '1'}
 
 def new_session(name, dbfile):
@@ -31,12 +34,54 @@ def new_session(name, dbfile):
     Session = sessionmaker(bind=engine)
     return Session()
 
-def load_project(name):
-    session = new_session(name, db[name])
-    proj = session.query(models.Project).filter_by(name = name).one()
-    proj.session = session
-    proj.logger = new_logger(name, new_log_file_handler(db[name]))
-    return proj
+Job = namedtuple('Job', ['task_id', 'shell', 'module', 'app', 'instance', 'status', 'create_date', 'start_date', 'finish_date'])
+VIEWS = {}
+
+class ProjectView(object):
+    """Modules, apps and the last finished job of each task, read once per snap.db change."""
+    def __init__(self, name, dbfile):
+        super(ProjectView, self).__init__()
+        self.name = name
+        self.dbfile = dbfile
+        self.mtime = os.path.getmtime(dbfile)
+        session = new_session(name, dbfile)
+        try:
+            self.modules = [m.name for m in session.query(models.Module.name).order_by(models.Module.id)]
+            self.apps = session.query(models.App.name, models.Module.name).\
+                outerjoin(models.Module, models.App.module_id == models.Module.id).\
+                order_by(models.App.id).all()
+            self.jobs = self.load_jobs(session)
+        finally:
+            session.close()
+
+    def __repr__(self):
+        return "<ProjectView(name={name}, jobs={jobs})>".format(name=self.name, jobs=len(self.jobs))
+
+    def load_jobs(self, session):
+        query = session.query(
+                models.Bcs.task_id, models.Task.shell, models.Module.name, models.App.name, models.Instance.name,
+                models.Bcs.status, models.Bcs.create_date, models.Bcs.start_date, models.Bcs.finish_date).\
+            join(models.Task, models.Bcs.task_id == models.Task.id).\
+            join(models.Project, models.Task.project_id == models.Project.id).\
+            outerjoin(models.Module, models.Task.module_id == models.Module.id).\
+            outerjoin(models.App, models.Task.app_id == models.App.id).\
+            outerjoin(models.Instance, models.Bcs.instance_id == models.Instance.id).\
+            filter(models.Project.name == self.name).\
+            filter(models.Bcs.status.in_(['Finished', 'Imported'])).\
+            order_by(models.Task.id, literal_column('bcs.rowid'))
+        jobs = OrderedDict()
+        for row in query:
+            jobs[row[0]] = Job(*row)
+        return jobs.values()
+
+    def is_changed(self):
+        return self.mtime != os.path.getmtime(self.dbfile)
+
+def load_view(name):
+    view = VIEWS.get(name)
+    if view is None or view.dbfile != db[name] or view.is_changed():
+        view = VIEWS[name] = ProjectView(name, db[name])
+    return view
 
 def make_options(opts):
     return map(lambda x:{'label':x, 'value':x}, opts)
@@ -81,6 +126,7 @@ app.layout = html.Div([
     dcc.Graph(
         id='graph-gantt'
     ),
+    html.Div(id='zoom-owner', style={'display': 'none'}),
     dcc.Checklist(
         options = make_options(['boxplot']),
         values = [],
@@ -93,9 +139,9 @@ app.layout = html.Div([
     [Input('project_id', 'value')]
 )
 def set_modules_options(project_id):
-    proj = load_project(project_id)
-    modules = proj.session.query(models.Module).all()
-    options=make_options([m.name for m in modules])
+    if not project_id:
+        return []
+    options=make_options(load_view(project_id).modules)
     return options
 
 @app.callback(
@@ -104,15 +150,18 @@ def set_modules_options(project_id):
      Input('modules', 'value'),]
 )
 def set_apps_options(project_id, modules):
-    proj = load_project(project_id)
-    apps = proj.session.query(models.App).all()
+    if not project_id:
+        return []
+    apps = load_view(project_id).apps
     if modules:
-        apps = [a for a in apps if a.module.name in modules]
-    options=make_options([a.name for a in apps])
+        apps = [a for a in apps if a[1] in modules]
+    options=make_options([a[0] for a in apps])
     return options
 
+# relayoutData keeps the last zoom when the selection changes, the figure is
+# redrawn through zoom-owner on those changes so the old zoom is ignored
 @app.callback(
-    Output('graph-gantt', 'figure'),
+    Output('zoom-owner', 'children'),
     [
      Input('project_id', 'value'),
      Input('mode', 'value'),
@@ -120,29 +169,42 @@ def set_apps_options(project_id, modules):
      Input('apps', 'value'),
      Input('show', 'values'),
      Input('boxplot', 'values'),
-    ])
-def update_figure(project_id, mode, modules, apps, show, boxplot):
-    def pick_job(jobs):
-        jobs = filter(lambda x:x.status in ['Finished', 'Imported'], jobs)
-        return jobs[-1] if jobs else None
+    ],
+    [State('graph-gantt', 'relayoutData')])
+def update_zoom_owner(project_id, mode, modules, apps, show, boxplot, relayout):
+    return zoom_owner([project_id, mode, modules, apps, show, boxplot], relayout)
 
+@app.callback(
+    Output('graph-gantt', 'figure'),
+    [
+     Input('zoom-owner', 'children'),
+     Input('graph-gantt', 'relayoutData'),
+    ],
+    [
+     State('project_id', 'value'),
+     State('mode', 'value'),
+     State('modules', 'value'),
+     State('apps', 'value'),
+     State('show', 'values'),
+     State('boxplot', 'values'),
+    ])
+def update_figure(owner, relayout, project_id, mode, modules, apps, show, boxplot):
     def filter_jobs(jobs):
-        jobs = filter(lambda x:x is not None, jobs)
         if modules:
-            jobs = filter(lambda x:x.task.module.name in modules, jobs)
+            jobs = filter(lambda x:x.module in modules, jobs)
         if apps:
-            jobs = filter(lambda x:x.task.app.name in apps, jobs)
+            jobs = filter(lambda x:x.app in apps, jobs)
 
         return jobs
 
     def build_task(job):
-        return {'Task': get_task_name[mode](job), 'Start':job.__getattribute__(job_start), 'Finish':job.__getattribute__(job_finish)}
+        return {'Task': get_task_name[mode](job), 'Start':getattr(job, job_start), 'Finish':getattr(job, job_finish)}
 
     get_task_name = {
-        'Task': lambda x:os.path.basename(x.task.shell),
-        'App': lambda x:x.task.app.name,
-        'Module': lambda x:x.task.module.name,
-        'Instance': lambda x:x.instance.name}
+        'Task': lambda x:os.path.basename(x.shell),
+        'App': lambda x:x.app,
+        'Module': lambda x:x.module,
+        'Instance': lambda x:x.instance}
 
     def choose_start_finish():
         if 'waited' in show and 'elapsed' in show:
@@ -157,8 +219,27 @@ def update_figure(project_id, mode, modules, apps, show, boxplot):
     def pick_start(element):
         return element['Start']
 
+    def visible_jobs(df):
+        (zoom_start, zoom_finish) = map(pd.to_datetime, zoomed)
+        return filter(lambda x:x['Finish'] >= zoom_start and x['Start'] <= zoom_finish, df)
+
+    def merge_jobs(df):
+        # bars of a row closer than span / GANTT_RESOLUTION can not be told apart, draw them as one
+        start = min([i['Start'] for i in df])
+        finish = max([i['Finish'] for i in df])
+        if zoomed:
+            (df, start, finish) = [visible_jobs(df)] + map(pd.to_datetime, zoomed)
+        resolution = (finish - start) / GANTT_RESOLUTION
+        intervals = defaultdict(list)
+        [intervals[i['Task']].append((i['Start'], i['Finish'])) for i in df]
+        df = [{'Task': name, 'Start': s, 'Finish': f} for name, value in intervals.iteritems() for s, f in merge_intervals(value, resolution)]
+        return sorted(df, key=pick_start)
+
     def prepare_gantt(df):
-        return ff.create_gantt(df, group_tasks=True)
+        fig = ff.create_gantt(merge_jobs(df), group_tasks=True)
+        if zoomed:
+            fig['layout']['xaxis']['range'] = list(zoomed)
+        return fig
 
     def make_task_trace(name, value):
         return {
@@ -178,12 +259,16 @@ def update_figure(project_id, mode, modules, apps, show, boxplot):
         fig['layout']['showlegend'] = False
         return fig
 
-    proj = load_project(project_id)
-    jobs = [pick_job(t.bcs) for t in proj.task if t.bcs]
-    jobs = filter_jobs(jobs)
+    if not project_id:
+        return {'data': [], 'layout': {}}
+    jobs = filter_jobs(load_view(project_id).jobs)
     job_start, job_finish = choose_start_finish()
     df = map(build_task, jobs)
     df = sorted(df, key=pick_start)
+    # boxplots are zoomed in hours, a zoom with no job in it is not kept
+    zoomed = selection_zoom(relayout, owner) if 'boxplot' not in boxplot else None
+    if zoomed and not visible_jobs(df):
+        zoomed = None
     task_time =  defaultdict(list)
 
     if 'boxplot' in boxplot:
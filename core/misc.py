@@ -1,6 +1,7 @@
 import yaml
 import logging
 import os
+from multiprocessing.dummy import Pool as ThreadPool
 
 def loadYaml(filename):
     with open(filename, 'r') as yaml_file:
@@ -53,4 +54,16 @@ def question(msg):
     else:
         return True
 
+def thread_map(func, items, threads=10):
+    items = list(items)
+    threads = min(int(threads or 1), len(items))
+    if threads <= 1:
+        return map(func, items)
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
 concat = lambda x, y: x + y
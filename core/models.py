@@ -1,9 +1,9 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, ForeignKey, create_engine, Table
+from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, ForeignKey, create_engine, Table, event, func
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
 from state_machine import *
 from crontab import CronTab
 from batchcompute.resources import (
@@ -11,26 +11,24 @@ from batchcompute.resources import (
     GroupDescription, ClusterDescription, Disks, Notification, )
 from batchcompute.resources.cluster import Mounts, MountEntry
 from batchcompute import ClientError
-from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.acs_exception.exceptions import ClientException
-from aliyunsdkcore.acs_exception.exceptions import ServerException
-from aliyunsdkecs.request.v20140526 import DescribeSpotPriceHistoryRequest
 from core.ali.bcs import CLIENT
+from core.ali.ecs import PRICE_CACHE
+from core.ali.transfer import Transfer
 from core.ali import ALI_CONF
-from core.ali.oss import BUCKET, oss2key, OSSkeys, read_object
+from core.ali.oss import BUCKET, LISTING, oss2key, OSSkeys, read_object
 from core.formats import *
 from core.misc import *
 from core.notification.dingtalk import send_msg
+from core.scheduler import Scheduler
 from colorMessage import dyeWARNING, dyeFAIL, dyeOKGREEN
 from collections import Counter
 from oss2.exceptions import NoSuchKey
 from oss2 import ObjectIterator
 from argparse import Namespace
-from flask import Flask
 from jinja2 import Template
 from StringIO import StringIO
-import pandas as pd
-import numpy as np
+from contextlib import contextmanager
 import functools
 import getpass
 import datetime
@@ -61,6 +59,23 @@ CLOUD = 0
 CLOUD_EFFICIENT = 1
 CLOUD_SSD = 2
 
+# failed jobs of a task before it is no longer retried
+MAX_FAILED = 3
+
+def new_engine(db_path):
+    engine = create_engine('sqlite:///' + db_path)
+
+    # pysqlite breaks SAVEPOINT, let SQLAlchemy emit BEGIN by itself
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def emit_begin(conn):
+        conn.execute('BEGIN')
+
+    return engine
+
 def catchClientError(func):
     def wrapper(*args, **kw):
         try:
@@ -97,6 +112,8 @@ class Project(Base):
 
     session = None
     logger = None
+    scheduler = None
+    batch = False
     message = []
 
     def __repr__(self):
@@ -109,17 +126,29 @@ class Project(Base):
         return diff_date(get_date(self.start_date), get_date(self.finish_date))
 
     def sync(self):
+        self.message = []
         self.poll()
         if self.reach_max_jobs():
             print dyeWARNING('Reach max job limit')
-            os._exit(0)
+            return
 
-        self.lock_sync()
-        to_sync = [t for t in self.task if t.is_waiting or t.is_running]
-        to_check = [t for t in self.task if t.is_created or t.is_pending or t.is_failed]
-        map(lambda x:x.check(), to_sync)
-        map(lambda x:x.check(), to_check)
-        self.unlock_sync()
+        if not self.lock_sync():
+            return
+        try:
+            scheduler = self.load_scheduler()
+            check = lambda x:x.check()
+            with LISTING.hold(), self.unit_of_work():
+                self.apply_all(scheduler.to_sync(), check)
+                # after jobs finished above released their successors, inputs of every task that
+                # may be submitted (ready, created, failed but retried) are checked against one fresh listing,
+                # a chunk rolled back above dropped the scheduler
+                scheduler = self.load_scheduler()
+                failed = self.count_failed(scheduler.select(['failed']))
+                to_check = [t for t in scheduler.to_check() if failed.get(t, 0) < MAX_FAILED]
+                self.list_objects(self.get_input_mappings(to_check), refresh=True)
+                self.apply_all(to_check, check)
+        finally:
+            self.unlock_sync()
 
         if self.cluster and self.auto_scale:
             self.cluster.auto_scale()
@@ -129,16 +158,93 @@ class Project(Base):
         self.notify()
         self.log_date()
 
+    @contextmanager
+    def unit_of_work(self):
+        self.batch = True
+        try:
+            yield
+        finally:
+            self.batch = False
+        self.save()
+
+    def apply(self, task, func):
+        old_state = task.aasm_state
+        savepoint = self.session.begin_nested()
+        try:
+            func(task)
+        except Exception, e:
+            if savepoint.is_active:
+                savepoint.rollback()
+            if self.scheduler is not None:
+                self.scheduler.update(task.id, task.aasm_state)
+            msg = task.msg(str(e))
+            print dyeFAIL(msg)
+            self.logger.error(msg)
+            return False
+
+        if savepoint.is_active:
+            savepoint.commit()
+        if task.is_waiting and old_state != 'waiting':
+            # a job was submitted or restarted on BatchCompute, keep its record out of the rest of the batch
+            self.save()
+        return True
+
+    def apply_all(self, ids, func, step=500):
+        for i in range(0, len(ids), step):
+            map(lambda x:self.apply(x, func), self.get_tasks(ids[i:i + step]))
+            # commit each chunk, other snap commands wait for the write lock until then
+            self.save()
+
+    def load_scheduler(self):
+        if self.scheduler is None:
+            states = self.session.query(Task.id, Task.aasm_state).all()
+            depends = self.session.query(dependence_table.c.task_id, dependence_table.c.depend_task_id).all()
+            self.scheduler = Scheduler(states, depends)
+        return self.scheduler
+
+    def get_tasks(self, ids, step=500):
+        tasks = []
+        for i in range(0, len(ids), step):
+            tasks.extend(self.session.query(Task).filter(Task.id.in_(ids[i:i + step])).order_by(Task.id).all())
+        return tasks
+
+    def count_failed(self, ids, step=500):
+        counts = {}
+        for i in range(0, len(ids), step):
+            q = self.session.query(Bcs.task_id, func.count(Bcs.id)).filter(
+                Bcs.task_id.in_(ids[i:i + step]), Bcs.status == 'Failed').group_by(Bcs.task_id)
+            counts.update(q.all())
+        return counts
+
+    def get_input_mappings(self, ids, step=500):
+        mappings = []
+        for i in range(0, len(ids), step):
+            q = self.session.query(Mapping).join(task_mapping_table).filter(
+                task_mapping_table.c.task_id.in_(ids[i:i + step]), Mapping.is_write == False)
+            mappings.extend(q.all())
+        return mappings
+
+    def list_objects(self, mappings=None, refresh=False):
+        def get_folder(destination):
+            key = oss2key(destination)
+            return key[:key.rfind('/') + 1]
+
+        if mappings is None:
+            mappings = self.session.query(Mapping).all()
+        prefixes = set([get_folder(m.destination) for m in mappings])
+        LISTING.list([p for p in prefixes if p and not p.startswith('oss://')], ALI_CONF.get('list_threads', 10), refresh)
+
     def lock_sync(self):
         lock_file = os.path.join(self.path, '.lock')
         if not os.path.exists(lock_file) or time.time() - os.path.getctime(lock_file) > 120:
             with open(lock_file, 'a'):
                 os.utime(lock_file, None)
+            return True
         else:
             msg = 'Other snap process is syncing, please wait. Or maybe last sync is failed, then delete %s to continue.' % lock_file
             print dyeWARNING(msg)
             self.logger.info(msg)
-            os._exit(1)
+            return False
 
     def unlock_sync(self):
         lock_file = os.path.join(self.path, '.lock')
@@ -166,9 +272,17 @@ class Project(Base):
             message = "**{project} (100%)**".format(project=self.name)
             send_msg(message, title=self.name)
 
-    def poll(self):
+    def poll(self, threads=None):
+        def update_each(bcs, state):
+            if state is not None:
+                bcs.update_state(state)
+
+        if threads is None:
+            threads = ALI_CONF.get('poll_threads', 10)
         bcs = self.session.query(Bcs).filter( (Bcs.status=='Waiting') | (Bcs.status=='Running') ).all()
-        map(lambda x:x.poll(), bcs)
+        states = thread_map(lambda x:x.fetch(), bcs, threads)
+        map(update_each, bcs, states)
+        self.save()
 
     def check_too_long(self, status='Waiting', timeout=3600):
         build_msg = lambda x, y: "- <{id}> *{sh}* has been {status} for {time}".format(id=x.id, sh=os.path.basename(x.shell), status=status, time=y)
@@ -352,6 +466,9 @@ class Project(Base):
         return self.count_active_jobs() >= self.max_job
 
     def billing(self, billing_path):
+        import pandas as pd
+        import cPickle as pickle
+
         def date_dirs():
             dates = []
             if self.start_date:
@@ -371,18 +488,60 @@ class Project(Base):
                 i = i + datetime.timedelta(days=1)
             return dates
 
+        def empty_bill():
+            # keep a string index, resource ids are split with the .str accessor
+            return pd.Series([], index=pd.Index([], dtype=object), dtype=float)
+
         def read_bill(billing_file):
-            with open(billing_file, 'r') as billing_csv:
-                bill_reader = csv.reader(billing_csv)
-                map(add_cost, bill_reader)
-
-        def add_cost(row):
-            job_id = row[11].split('_')[0]
-            cluster_id = row[11].split(';')[0]
-            if job_id in bcs:
-                bcs[job_id].cost += float(row[21])
-            if cluster_id in clusters:
-                clusters[cluster_id].cost += float(row[21])
+            # totals per resource id of the whole bill, not only this project's, jobs added later are still billed
+            if not os.path.getsize(billing_file):
+                return empty_bill()
+            reader = pd.read_csv(billing_file, header=None, usecols=[11, 21], dtype=str, chunksize=100000)
+            costs = [pd.to_numeric(chunk[21], errors='coerce').groupby(chunk[11]).sum() for chunk in reader]
+            if not costs:
+                return empty_bill()
+            return pd.concat(costs).groupby(level=0).sum()
+
+        def load_bill(billing_file):
+            stat = os.stat(billing_file)
+            watermark = (stat.st_mtime, stat.st_size)
+            imported = imports.get(billing_file)
+            if imported and imported[0] == watermark and isinstance(imported[1], pd.Series):
+                return imported[1]
+            costs = read_bill(billing_file)
+            imports[billing_file] = (watermark, costs)
+            return costs
+
+        def load_imports():
+            if not os.path.exists(import_file):
+                return {}
+            try:
+                with open(import_file, 'rb') as f:
+                    return pickle.load(f)
+            except Exception, e:
+                print dyeWARNING('Broken billing import record: %s' % e)
+                return {}
+
+        def dump_imports():
+            tmp_file = '%s.%d' % (import_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(imports, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, import_file)
+
+        def add_cost(costs):
+            # a bill has far fewer resources than lines, split the ids once per resource
+            if costs.empty:
+                return
+            cost = costs.groupby(level=0).sum()
+            resource = cost.index.to_series()
+            job_id = resource.str.split('_', n=1).str[0]
+            cluster_id = resource.str.split(';', n=1).str[0]
+            is_job = job_id.isin(bcs)
+            is_cluster = cluster_id.isin(clusters)
+            for k, v in cost[is_job].groupby(job_id[is_job]).sum().iteritems():
+                bcs[k].cost += v
+            for k, v in cost[is_cluster].groupby(cluster_id[is_cluster]).sum().iteritems():
+                clusters[k].cost += v
 
         def add_cluster_cost(b):
             if b.elapsed():
@@ -400,6 +559,11 @@ class Project(Base):
 
         if not self.finish_date:
             print dyeWARNING("Project not finished yet. Billing might be incomplete.")
+        import_path = os.path.expanduser('~/.snap/cache/billing')
+        if not os.path.exists(import_path):
+            os.makedirs(import_path)
+        import_file = os.path.join(import_path, '%s.pkl' % self.name)
+        imports = load_imports()
         bcs = self.session.query(Bcs).all()
         clusters = self.session.query(Cluster).all()
         map(zero_cost, bcs)
@@ -409,11 +573,14 @@ class Project(Base):
         bcs = {b.id:b for b in bcs}
         clusters = {c.id:c for c in clusters}
         dates = date_dirs()
+        billing_files = []
         for root, dirs, files in os.walk(billing_path):
             dirs[:] = [d for d in dirs if d in dates]
-            for billing_file in files:
-                if billing_file.endswith('.csv'):
-                    read_bill(os.path.join(root, billing_file))
+            billing_files.extend([os.path.join(root, f) for f in files if f.endswith('.csv')])
+        if billing_files:
+            add_cost(pd.concat(map(load_bill, billing_files)))
+        imports = {f: imports[f] for f in billing_files}
+        dump_imports()
         imported_bcs = [b for b in bcs.values() if b.status == 'Imported']
         if imported_bcs:
             print dyeWARNING("There're imported jobs, billing jobs with cluster might have problems")
@@ -439,6 +606,7 @@ class Project(Base):
                 bcs_cost,
                 data_cost + bcs_cost)
 
+        self.list_objects()
         if mode == 'task':
             elements = self.task
         elif mode == 'app':
@@ -452,6 +620,7 @@ class Project(Base):
         return sum([t.cost() for t in self.task])
 
     def cytoscape(self, args):
+        from flask import Flask
         cyto = Flask(__name__)
         @cyto.route('/')
         def network():
@@ -667,8 +836,74 @@ class Project(Base):
 
         return q.all()
 
-    def profile(self, tasks):
-        return pd.concat([t.profile() for t in tasks], ignore_index=True)
+    def profile(self, tasks, threads=10, jobs=None, cache=True):
+        import tempfile
+        import shutil
+        import threading
+        from multiprocessing import Pool, cpu_count
+        from multiprocessing.dummy import Pool as ThreadPool
+        from core.pidstat import load_profile_files
+        from core.store import ProfileStore
+
+        def download((task_id, pidstats, disk_usages)):
+            # a slot is released once the task is parsed and written, files of at most jobs * 2 tasks are kept
+            in_flight.acquire()
+            if stopped[0]:
+                return task_id, [], []
+
+            def get_file(obj):
+                path = os.path.join(tmp_path, obj.etag + '.' + os.path.basename(obj.key))
+                BUCKET.get_object_to_file(obj.key, path)
+                return (obj.key, path)
+            return task_id, map(get_file, pidstats), map(get_file, disk_usages)
+
+        def show_progress():
+            sys.stdout.write('profiling tasks: {done}/{total}\r'.format(done=done[0], total=len(tasks)))
+            sys.stdout.flush()
+
+        store = ProfileStore(self.name)
+        tasks_by_id = {t.id: t for t in tasks}
+        files = thread_map(lambda x:x.profile_files(), tasks, threads)
+        signatures = {}
+        done = [0]
+        to_load = []
+        for task, (pidstats, disk_usages) in zip(tasks, files):
+            signatures[task.id] = [[obj.key, obj.etag] for obj in pidstats + disk_usages]
+            if not pidstats or not disk_usages or (cache and store.signature(task.app.name, task.id) == signatures[task.id]):
+                done[0] += 1
+            else:
+                to_load.append((task.id, pidstats, disk_usages))
+        show_progress()
+
+        if to_load:
+            jobs = min(jobs or cpu_count(), len(to_load))
+            tmp_path = tempfile.mkdtemp(prefix='snap_profile.')
+            in_flight = threading.Semaphore(jobs * 2)
+            stopped = [False]
+            # fork parsers before the download threads start
+            parse_pool = Pool(jobs)
+            download_pool = ThreadPool(min(threads, len(to_load)))
+            try:
+                downloaded = download_pool.imap_unordered(download, to_load)
+                for task_id, profiles in parse_pool.imap_unordered(load_profile_files, downloaded):
+                    task = tasks_by_id[task_id]
+                    if profiles is not None:
+                        profiles = task.add_profile_columns(profiles)
+                    store.write(task.app.name, task.id, profiles, signatures[task_id])
+                    in_flight.release()
+                    done[0] += 1
+                    show_progress()
+                parse_pool.close()
+                download_pool.close()
+            finally:
+                # wake downloads waiting for a slot, the parse pool waits for them when it terminates
+                stopped[0] = True
+                map(lambda x:in_flight.release(), to_load)
+                parse_pool.terminate()
+                download_pool.terminate()
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        print
+        return store
 
     def update(self, **kwargs):
         commom_keys = set(['name', 'description', 'owner', 'status', 'max_job', 'run_cnt', 'discount', 'email', 'mns', 'cluster', 'auto_scale']) & set(kwargs.keys())
@@ -682,16 +917,26 @@ class Project(Base):
         self.save()
         print "Project {id} updated: ".format(id = self.id) + updated
 
-    def save(self):
+    def save(self, retries=3):
         try:
             self.session.commit()
         except Exception, e:
+            if retries and isinstance(e, OperationalError) and 'database is locked' in str(e):
+                # sqlite keeps the transaction open when COMMIT is refused, commit it again
+                print dyeWARNING(str(e))
+                time.sleep(1)
+                return self.save(retries - 1)
             print dyeFAIL(str(e))
             self.session.rollback()
+            # transitions rolled back above are still applied to the scheduler
+            self.scheduler = None
+
+    def clean_files(self, immediate=True, dry_run=False, threads=10):
+        def get_folder(key):
+            return key[:key.rfind('/') + 1]
 
-    def clean_files(self, immediate=True):
-        def iter_dir(prefix):
-            return [obj.key for obj in ObjectIterator(BUCKET, prefix=prefix)]
+        def delete(keys):
+            return BUCKET.batch_delete_objects(keys).deleted_keys
 
         if immediate:
             immediate_write = [m.destination for m in self.session.query(Mapping).filter_by(is_write = True, is_immediate = True).all()]
@@ -699,14 +944,26 @@ class Project(Base):
             to_delete = set(all_read) & set(immediate_write)
         else:
             to_delete = set([m.destination for m in self.session.query(Mapping).filter_by(is_write = True).all()])
-        dir_to_delete = sum([iter_dir(f) for f in to_delete if f.endswith('/')], [])
-        to_delete.update(dir_to_delete)
-        oss_keys = OSSkeys(map(oss2key, to_delete))
-        for keys in oss_keys:
-            result = BUCKET.batch_delete_objects(keys)
-        num_keys = len(result.deleted_keys)
-        deleted_size = human_size(self.size_stat(to_delete)['project'])
-        print "{num} files({size}) deleted.".format(num=num_keys, size=deleted_size)
+        to_delete = set(map(oss2key, to_delete))
+        dirs = [k for k in to_delete if k.endswith('/')]
+        files = to_delete - set(dirs)
+        LISTING.list(dirs + [get_folder(k) for k in files if get_folder(k)], threads)
+
+        objects = {k: LISTING.sizes[k] for d in dirs for k in LISTING.scan(d)}
+        objects.update({k: LISTING.sizes[k] for k in files if k in LISTING.sizes})
+        # files outside any listed folder are deleted blindly, as before
+        objects.update({k: 0 for k in files if not LISTING.covers(k)})
+        size = human_size(sum(objects.values()))
+        if dry_run:
+            print "{num} files({size}) to be deleted.".format(num=len(objects), size=size)
+            return
+
+        deleted = []
+        for keys in thread_map(delete, [keys for keys in OSSkeys(sorted(objects)) if keys], threads):
+            LISTING.remove(keys)
+            deleted.extend(keys)
+        size = human_size(sum([objects.get(k, 0) for k in deleted]))
+        print "{num} files({size}) deleted.".format(num=len(deleted), size=size)
 
     def clean_bcs(self):
         bcs = self.session.query(Bcs).filter_by(deleted=False).all()
@@ -717,17 +974,14 @@ class Project(Base):
         print "{num} jobs deleted.".format(num=len(bcs))
 
     def size_stat(self, to_delete=None):
-        total = 0
-        clean_total = 0
-        for obj in ObjectIterator(BUCKET, prefix="project/%s/" % self.name):
-            if to_delete:
-                if obj.key in to_delete:
-                    total += obj.size
-            else:
-                total += obj.size
-
-        for obj in ObjectIterator(BUCKET, prefix="clean/%s/" % self.name):
-            clean_total += obj.size
+        project_prefix = "project/%s/" % self.name
+        clean_prefix = "clean/%s/" % self.name
+        LISTING.list([project_prefix, clean_prefix])
+        if to_delete:
+            total = sum([LISTING.sizes[k] for k in LISTING.scan(project_prefix) if k in to_delete])
+        else:
+            total = LISTING.size(project_prefix)
+        clean_total = LISTING.size(clean_prefix)
 
         return {'clean': clean_total, 'project': total}
 
@@ -1139,12 +1393,29 @@ class Task(Base):
     @after('redo')
     @after('clean')
     def save(self):
+        if self.project.batch:
+            return
         try:
             self.project.session.commit()
         except Exception, e:
             print dyeFAIL(str(e))
             self.project.session.rollback()
 
+    @after('start')
+    @after('restart')
+    @after('stop')
+    @after('submit')
+    @after('run')
+    @after('finish')
+    @after('fail')
+    @after('kill')
+    @after('retry')
+    @after('redo')
+    @after('clean')
+    def update_scheduler(self):
+        if self.project.scheduler is not None:
+            self.project.scheduler.update(self.id, self.aasm_state)
+
     @after('start')
     @after('redo')
     @after('fail')
@@ -1160,7 +1431,7 @@ class Task(Base):
                 pass
         elif self.is_waiting or self.is_running:
             self.sync()
-        elif self.is_failed and not self.reach_max_failed(3):
+        elif self.is_failed and not self.reach_max_failed(MAX_FAILED):
             self.retry()
 
         if self.aasm_state != old_state:
@@ -1168,6 +1439,8 @@ class Task(Base):
             self.project.logger.info(msg)
 
     def is_dependence_satisfied(self):
+        if self.project.scheduler is not None:
+            return self.project.scheduler.is_ready(self.id)
         is_finished = [t.is_finished or t.is_cleaned for t in self.depend_on]
         if all(is_finished):
             return True
@@ -1221,8 +1494,9 @@ class Task(Base):
             bcs.stderr = os.path.join(task.Parameters.StdoutRedirectPath, "stderr." + log_id)
             self.bcs.append(bcs)
         except ClientError, e:
-            # better try in check section
-            self.project.session.rollback()
+            # better try in check section, a batch rolls back only this task's savepoint
+            if not self.project.batch:
+                self.project.session.rollback()
             msg = self.msg(str(e))
             print dyeFAIL(msg)
             self.project.logger.error(msg)
@@ -1631,6 +1905,9 @@ class Task(Base):
                     self.project.logger.warning(msg)
 
         output_mappings = [m for m in self.mapping if m.is_write and m.is_required]
+        # outputs are written by the job, refresh what has been listed before
+        keys = [oss2key(m.destination) for m in output_mappings]
+        map(LISTING.refresh, filter(LISTING.covers, keys))
         map(check_each_output, output_mappings)
 
     def size(self, is_write=None):
@@ -1663,108 +1940,21 @@ class Task(Base):
 
     @after('fail')
     def enqueue_failed_message(self):
-        if self.reach_max_failed(3):
+        if self.reach_max_failed(MAX_FAILED):
             msg = "- <{id}> *{sh}* {status} | [detail](#)".format(id=self.id, module=self.module.name, app=self.app.name, sh=os.path.basename(self.shell), status=self.aasm_state)
             self.project.message.append(msg)
 
-    def profile(self):
-        def load_disk_usage(key):
-            content = read_object(key, full=True)
-            lines = content.split('\n')
-            headers = lines[0].split()
-            n_column = len(headers)
-            lines = filter(lambda x:'127.0.0.1' not in x, lines)
-            lines = filter(lambda x: len(x.split()) <= n_column, lines)
-            content = "\n".join(lines)
-            du = pd.read_table(StringIO(content), delim_whitespace=True)
-            return pd.DataFrame({
-                'sys': du[du.Mounted == '/'].reset_index().Used.astype('int64'),
-                'data': du[du.Filesystem == '/dev/xvdb1'].reset_index().Used.astype('int64'),
-                'file': os.path.basename(key).rstrip('.disk_usage') })
-
-        def add_time_disk_usage(ps, du):
-            if ps is None:
-                return None
-            times = ps.Time.unique()
-            lack_num = len(du) - len(times)
-            if len(times) <= 1:
-                step = times[0] + 60000000000
-            else:
-                step = times[1]
-            if lack_num > 0:
-                lack = times[-1] + step * np.arange(1, lack_num + 1)
-                times = np.append(times, lack)
-            elif lack_num < 0:
-                times = times[:lack_num]
-            du['Time'] = times
-            du['sys'] = du['sys'] - du['sys'][0]
-            return du
-
-        def process_pidstat_line(line, cmd_idx):
-            elements = line.strip().split()
-            return "\t".join(elements[:cmd_idx]) + '\t' + " ".join(elements[cmd_idx:])
-
-        def extract_command(cmd):
-            match = pattern.search(cmd)
-            if match:
-                return match.group()
-            else:
-                return os.path.basename(cmd.split()[0])
-
-        def normalize_time(times, date):
-            if isinstance(times[0], str):
-                times = date + times
-                times = pd.to_datetime(times)
-                times = times - times[0]
-            elif times.dtype == 'int64':
-                times = pd.to_datetime(times, unit='s')
-                times = times - times[0]
-            else:
-                print "other type"
-                pdb.set_trace()
-            return times
-
-        def load_pidstat(key):
-            content = read_object(key, full=True)
-            lines = content.split('\n')
-            if len(lines) < 4:
-                return None
-            date = lines[0].split('\t')[1]
-            headers = [l for l in lines[:6] if l.startswith('#')].pop()
-            headers = headers.rstrip('\x00').lstrip('#').split()
-            n_column = len(headers)
-            cmd_idx = headers.index('Command')
-
-            lines = [process_pidstat_line(l, cmd_idx) for l in lines if not l.startswith('Linux') and l != '' and not l.startswith('#')]
-            lines = [l for l in lines if l[:10].isdigit() or l[2] == ':']
-            lines = [l for l in lines if len(l.strip('\t').split('\t')) == n_column]
-            content = "\n".join(lines)
-            ps = pd.read_table(StringIO(content), sep='\t', header=None, names=headers)
-
-            ps['Program'] = map(extract_command, ps.Command)
-            ps['file'] = os.path.basename(key).rstrip('.pidstat')
-            ps = ps[~ps.Program.isin(['cron', 'CRON', 'crond', 'pidstat'])].reset_index()
-            ps.Time = normalize_time(ps.Time, date)
-
-            return ps
-
-        sys.stdout.write('processing task %s\r' % self.id)
-        sys.stdout.flush()
-        pattern = re.compile(r'\w+\.(jar|R|pl|py)')
+    def profile_files(self):
         sh = filter(lambda x:x.name =='sh', self.mapping)[0]
         key = oss2key(sh.destination.rstrip('sh'))
-        related_files = [obj.key for obj in ObjectIterator(BUCKET, prefix=key)]
-        pidstats = filter(lambda x:x.endswith('pidstat'), related_files)
-        disk_usages = filter(lambda x:x.endswith('disk_usage'), related_files)
+        related_files = [obj for obj in ObjectIterator(BUCKET, prefix=key)]
+        pidstats = filter(lambda x:x.key.endswith('pidstat'), related_files)
+        disk_usages = filter(lambda x:x.key.endswith('disk_usage'), related_files)
         if len(pidstats) != len(disk_usages):
             raise ValueError('{id}\tThe number of pidstats and disk_usages is differ'.format(id=self.id))
-        if not pidstats or not disk_usages:
-            return None
+        return pidstats, disk_usages
 
-        pidstats = map(load_pidstat, pidstats)
-        disk_usages = map(load_disk_usage, disk_usages)
-        disk_usages = map(lambda x:add_time_disk_usage(*x), zip(pidstats, disk_usages))
-        profiles = pd.merge(pd.concat(pidstats), pd.concat(disk_usages), how='left')
+    def add_profile_columns(self, profiles):
         profiles['App'] = self.app.name
         profiles['Module'] = self.module.name
         profiles['Instance'] = self.instance.name
@@ -1818,12 +2008,19 @@ class Bcs(Base):
         self.id = CLIENT.create_job(self.job).Id
         self.status = 'Waiting'
 
+    @catchClientError
+    def fetch(self):
+        return CLIENT.get_job(self.id)
+
+    def update_state(self, state):
+        self.state = state
+        self.status = state.State
+        self.start_date = state.StartTime
+        self.finish_date = state.EndTime
+
     @catchClientError
     def poll(self):
-        self.state = CLIENT.get_job(self.id)
-        self.status = self.state.State
-        self.start_date = self.state.StartTime
-        self.finish_date = self.state.EndTime
+        self.update_state(CLIENT.get_job(self.id))
         self.task.project.session.commit()
 
     @catchClientError
@@ -1854,6 +2051,7 @@ class Bcs(Base):
         stderr = oss2key(self.stderr)
         BUCKET.delete_object(stdout)
         BUCKET.delete_object(stderr)
+        LISTING.remove([stdout, stderr])
 
     def show_log(self, type, cache=True):
         oss_path = self.__getattribute__(type)
@@ -1962,22 +2160,7 @@ class Instance(Base):
 	    id=self.id, name=self.name, cpu=self.cpu, mem=self.mem, price=self.price)
 
     def history_price(self, day=None):
-        client = AcsClient(ALI_CONF['accesskey_id'], ALI_CONF['accesskey_secret'], ALI_CONF['region'])
-        request = DescribeSpotPriceHistoryRequest.DescribeSpotPriceHistoryRequest()
-        request.set_NetworkType('vpc')
-        request.set_InstanceType(self.name)
-        if day:
-            utc_now = datetime.datetime.utcnow()
-            utc_start = utc_now - datetime.timedelta(days=day)
-            request.set_StartTime(utc_start.strftime("%Y-%m-%dT%H:%M:%SZ"))
-            request.set_EndTime(utc_now.strftime("%Y-%m-%dT%H:%M:%SZ"))
-        try:
-            response = client.do_action_with_exception(request)
-        except ServerException, e:
-            print dyeFAIL(str(e) + " Instance Type: %s" % self.name)
-            return []
-        prices = json.loads(response)
-        return prices['SpotPrices']['SpotPriceType']
+        return PRICE_CACHE.history(self.name, day)
 
     def latest_price(self):
         prices = self.history_price()
@@ -2010,12 +2193,16 @@ class Mapping(Base):
         is_exists = BUCKET.object_exists(key)
         if is_exists:
             BUCKET.delete_object(key)
+            LISTING.remove([key])
         elif not is_exists and recursive:
             keys = [obj.key for obj in ObjectIterator(BUCKET, prefix=key)]
             BUCKET.batch_delete_objects(keys)
+            LISTING.remove(keys)
 
     def size(self):
         key = oss2key(self.destination)
+        if LISTING.covers(key):
+            return LISTING.size(key)
         return sum([obj.size for obj in ObjectIterator(BUCKET, prefix=key)])
 
     def source_size(self):
@@ -2029,6 +2216,8 @@ class Mapping(Base):
 
     def exists(self):
         key = oss2key(self.destination)
+        if LISTING.covers(key):
+            return LISTING.exists(key)
         is_exists = BUCKET.object_exists(key)
         if not is_exists:
             try:
@@ -2070,19 +2259,20 @@ class Mapping(Base):
             print dyeOKGREEN('Affected tasks:')
             print format_tasks_tbl(set(affected_task))
 
-    def sync(self, overwrite=False):
+    def sync(self, overwrite=False, transfer=None):
         if self.is_write:
-            self.download(overwrite)
+            self.download(overwrite, transfer)
         else:
-            self.upload(overwrite)
+            self.upload(overwrite, transfer)
 
-    def download(self, overwrite=False):
-        self._ossutil(self.destination, self.source, overwrite)
+    def download(self, overwrite=False, transfer=None):
+        self._transfer(self.destination, self.source, overwrite, transfer)
 
-    def upload(self, overwrite=False):
-        self._ossutil(self.source, self.destination, overwrite)
+    def upload(self, overwrite=False, transfer=None):
+        self._transfer(self.source, self.destination, overwrite, transfer)
 
-    def _ossutil(self, source, destination, overwrite=False):
+    def _transfer(self, source, destination, overwrite=False, transfer=None):
+        """Copy source to destination. Copies are queued in `transfer` if given, or run at once."""
         def is_path_exists(path):
             if path.startswith('oss://'):
                 return self.exists()
@@ -2098,27 +2288,31 @@ class Mapping(Base):
         def is_dir(path):
             return path.endswith('/') or (not path.startswith('oss://') and os.path.isdir(path))
 
-        def traversal_key(source, destination):
-            if source.startswith('oss://') and source.endswith('/'):
-                key = oss2key(source)
-                sources = [obj.key for obj in ObjectIterator(BUCKET, prefix=key)]
-                sources = filter(lambda x:not x.endswith('/'), sources)
-                destinations = [destination + s.replace(key, '') for s in sources]
-                sources = ["oss://{bucket}/{key}".format(bucket=BUCKET.bucket_name, key=s) for s in sources]
+        def download_jobs(source, destination):
+            key = oss2key(source)
+            if not source.endswith('/'):
+                if is_dir(destination):
+                    destination = os.path.join(destination, os.path.basename(key))
+                size = LISTING.sizes.get(key) if LISTING.covers(key) else None
+                return [(key, destination, size)]
+            if LISTING.covers(key):
+                objects = [(k, LISTING.sizes[k]) for k in LISTING.scan(key)]
             else:
-                sources = [source]
-                destinations = [destination]
-            return zip(sources, destinations)
-
-        def cp(src, dest):
-            cmdline = " ".join(cmd + [src, dest])
-            os.system(cmdline)
-
-        cmd = ['ossutil', 'cp']
-        if not source.startswith('oss://') and is_dir(source):
-            cmd.append('-r')
-        if overwrite:
-            cmd.append('-f')
+                objects = [(obj.key, obj.size) for obj in ObjectIterator(BUCKET, prefix=key)]
+            return [(k, os.path.join(destination, k.replace(key, '', 1)), size) for k, size in objects if not k.endswith('/')]
+
+        def upload_jobs(source, destination):
+            key = oss2key(destination)
+            if not os.path.isdir(source):
+                if key.endswith('/'):
+                    key = key + os.path.basename(source)
+                return [(source, key, None)]
+            jobs = []
+            for root, dirs, files in os.walk(source, followlinks=True):
+                for f in files:
+                    filename = os.path.join(root, f)
+                    jobs.append((filename, os.path.join(key, os.path.relpath(filename, source)), None))
+            return jobs
 
         is_source_exists = is_path_exists(source)
         is_destination_exists = is_path_exists(destination)
@@ -2129,7 +2323,15 @@ class Mapping(Base):
 
         if (overwrite or not is_destination_exists) and is_source_exists:
             print dyeOKBLUE(msg % 'Syncing')
-            [cp(src, dest) for src, dest in traversal_key(source, destination)]
+            run = transfer is None
+            if run:
+                transfer = Transfer(ALI_CONF.get('transfer_threads', 10))
+            if source.startswith('oss://'):
+                [transfer.download(*job) for job in download_jobs(source, destination)]
+            else:
+                [transfer.upload(*job) for job in upload_jobs(source, destination)]
+            if run:
+                transfer.run()
         else:
             print dyeWARNING(msg % 'Skipped')
 
@@ -0,0 +1,265 @@
+import os
+import re
+import itertools
+from array import array
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+IGNORED_PROGRAMS = set(['cron', 'CRON', 'crond', 'pidstat'])
+PROGRAM_PATTERN = re.compile(r'\w+\.(jar|R|pl|py)')
+NA_VALUES = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null'])
+PROMOTIONS = {np.int64: np.float64, np.float64: object}
+# np.fromstring stops silently at the first unparsable character, only trust
+# it on text made of these characters
+FAST_CHARS = {np.int64: '0123456789 ', np.float64: '0123456789. '}
+
+
+def extract_command(cmd):
+    match = PROGRAM_PATTERN.search(cmd)
+    if match:
+        return match.group()
+    else:
+        return os.path.basename(cmd.split()[0])
+
+
+class Column(object):
+    """Values of one column, converted block by block into int64, float64 or object arrays.
+
+    The type is guessed from the first value and promoted int64 -> float64 ->
+    object, blocks already stored included, when a later value does not fit.
+    As in pandas.read_table, NA_VALUES are read as NaN in float64 columns.
+    """
+    def __init__(self, name):
+        super(Column, self).__init__()
+        self.name = name
+        self.dtype = None
+        self.blocks = []
+        self.strings = {}
+
+    def guess(self, value):
+        if value in NA_VALUES:
+            return np.float64
+        for convert, dtype in ((int, np.int64), (float, np.float64)):
+            try:
+                convert(value)
+            except ValueError:
+                continue
+            return dtype
+        return object
+
+    def convert(self, values):
+        if self.dtype is object:
+            values = [self.strings.setdefault(v, v) for v in values]
+            return np.array(values, dtype=object)
+        text = " ".join(values)
+        if not text.translate(None, FAST_CHARS[self.dtype]):
+            block = np.fromstring(text, dtype=self.dtype, sep=" ")
+            if len(block) == len(values):
+                return block
+        if self.dtype is np.float64:
+            values = ['nan' if v in NA_VALUES else v for v in values]
+        return np.array(values).astype(self.dtype)
+
+    def promote(self):
+        self.dtype = PROMOTIONS[self.dtype]
+        self.blocks = [b.astype(self.dtype) for b in self.blocks]
+
+    def extend(self, values):
+        if self.dtype is None:
+            self.dtype = self.guess(values[0])
+        while True:
+            try:
+                block = self.convert(values)
+            except (ValueError, OverflowError):
+                self.promote()
+            else:
+                break
+        self.blocks.append(block)
+
+    def to_array(self):
+        if not self.blocks:
+            return np.array([], dtype=self.dtype or object)
+        return np.concatenate(self.blocks)
+
+
+def is_sample(elements):
+    time = elements[0]
+    return (len(time) >= 10 and time[:10].isdigit()) or time[2:3] == ':'
+
+
+def parse_pidstat(lines, block_size=10000):
+    """Parse pidstat output line by line into numpy columns.
+
+    Rows of cron and pidstat itself are dropped while scanning, the kept rows
+    are converted every `block_size` rows, so only one block of tokens is held
+    in memory. Return
+    (date, columns) where columns starts with `index`, the position of the row
+    among all samples, followed by the pidstat headers and `Program`.
+    None is returned if there is no header.
+    """
+    lines = iter(lines)
+    head = list(itertools.islice(lines, 6))
+    headers = [l for l in head if l.startswith('#')]
+    if len(head) < 4 or not headers:
+        return None
+    date = head[0].split('\t')[1]
+    headers = headers.pop().rstrip('\x00').lstrip('#').split()
+    cmd_idx = headers.index('Command')
+    if cmd_idx != len(headers) - 1:
+        return None
+
+    columns = [Column(h) for h in headers + ['Program']]
+    index = array('l')
+    rows = []
+    commands = {}
+
+    def flush():
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+        del rows[:]
+
+    n_sample = 0
+    for line in itertools.chain(head, lines):
+        if line.startswith('Linux') or line == '' or line.startswith('#'):
+            continue
+        elements = line.split(None, cmd_idx)
+        if len(elements) <= cmd_idx or not is_sample(elements):
+            continue
+        if elements[cmd_idx] not in commands:
+            command = " ".join(elements[cmd_idx].split())
+            commands[elements[cmd_idx]] = (command, extract_command(command))
+        command, program = commands[elements[cmd_idx]]
+        n_sample += 1
+        if program in IGNORED_PROGRAMS:
+            continue
+        elements[cmd_idx] = command
+        index.append(n_sample - 1)
+        elements.append(program)
+        rows.append(elements)
+        if len(rows) == block_size:
+            flush()
+    flush()
+
+    columns = [('index', np.array(index, dtype=np.int64))] + [(c.name, c.to_array()) for c in columns]
+    return date, OrderedDict(columns)
+
+
+def parse_disk_usage(lines):
+    """Parse repeated `df` output, return the used size of / and /dev/xvdb1 as int64 arrays."""
+    lines = iter(lines)
+    headers = next(lines, '').split()
+    n_column = len(headers)
+    sys_used = array('l')
+    data_used = array('l')
+    try:
+        used_idx = headers.index('Used')
+        mounted_idx = headers.index('Mounted')
+        fs_idx = headers.index('Filesystem')
+    except ValueError:
+        return np.array(sys_used, dtype=np.int64), np.array(data_used, dtype=np.int64)
+
+    for line in lines:
+        if '127.0.0.1' in line:
+            continue
+        elements = line.split()
+        if not elements or len(elements) > n_column or len(elements) <= used_idx:
+            continue
+        mounted = elements[mounted_idx] if mounted_idx < len(elements) else None
+        filesystem = elements[fs_idx] if fs_idx < len(elements) else None
+        if mounted != '/' and filesystem != '/dev/xvdb1':
+            continue
+        try:
+            used = int(elements[used_idx])
+        except ValueError:
+            continue
+        if mounted == '/':
+            sys_used.append(used)
+        if filesystem == '/dev/xvdb1':
+            data_used.append(used)
+
+    return np.array(sys_used, dtype=np.int64), np.array(data_used, dtype=np.int64)
+
+
+def read_file_lines(path):
+    """Yield the lines of a local file as str.split('\\n') would."""
+    line = ''
+    with open(path) as f:
+        for line in f:
+            yield line[:-1] if line.endswith('\n') else line
+    if line == '' or line.endswith('\n'):
+        yield ''
+
+
+def normalize_time(times, date):
+    if isinstance(times[0], str):
+        times = date + times
+        times = pd.to_datetime(times)
+        times = times - times[0]
+    elif times.dtype in ('int64', 'float64'):
+        times = pd.to_datetime(times, unit='s')
+        times = times - times[0]
+    else:
+        raise ValueError('unsupported time column dtype %s' % times.dtype)
+    return times
+
+
+def load_pidstat(key, lines):
+    parsed = parse_pidstat(lines)
+    if parsed is None:
+        return None
+    date, columns = parsed
+    ps = pd.DataFrame(columns)
+    if ps.empty:
+        return None
+    ps['file'] = os.path.basename(key).rstrip('.pidstat')
+    ps.Time = normalize_time(ps.Time, date)
+
+    return ps
+
+
+def load_disk_usage(key, lines):
+    sys_used, data_used = parse_disk_usage(lines)
+    return pd.DataFrame({
+        'sys': pd.Series(sys_used),
+        'data': pd.Series(data_used),
+        'file': os.path.basename(key).rstrip('.disk_usage') })
+
+
+def add_time_disk_usage(ps, du):
+    if ps is None:
+        return None
+    times = ps.Time.unique()
+    lack_num = len(du) - len(times)
+    if len(times) <= 1:
+        step = times[0] + 60000000000
+    else:
+        step = times[1]
+    if lack_num > 0:
+        lack = times[-1] + step * np.arange(1, lack_num + 1)
+        times = np.append(times, lack)
+    elif lack_num < 0:
+        times = times[:lack_num]
+    du['Time'] = times
+    du['sys'] = du['sys'] - du['sys'][0]
+    return du
+
+
+def load_profile(pidstats, disk_usages):
+    """Merge pidstat and disk_usage logs, both given as (key, lines) pairs of the same bcs."""
+    pidstats = [load_pidstat(key, lines) for key, lines in pidstats]
+    disk_usages = [load_disk_usage(key, lines) for key, lines in disk_usages]
+    disk_usages = map(lambda x:add_time_disk_usage(*x), zip(pidstats, disk_usages))
+    if all([ps is None for ps in pidstats]):
+        return None
+    return pd.merge(pd.concat(pidstats), pd.concat(disk_usages), how='left')
+
+
+def load_profile_files((task_id, pidstats, disk_usages)):
+    """Process pool entry, logs are (key, path) pairs of downloaded files, removed after parsing."""
+    read = lambda files: [(key, read_file_lines(path)) for key, path in files]
+    try:
+        return task_id, load_profile(read(pidstats), read(disk_usages))
+    finally:
+        [os.remove(path) for key, path in pidstats + disk_usages if os.path.exists(path)]
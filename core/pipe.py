@@ -11,19 +11,33 @@ import glob
 import time
 import git
 import shutil
+import hashlib
+import cPickle as pickle
+import json
 from sqlalchemy import create_engine, UniqueConstraint
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import IntegrityError
 from collections import defaultdict
+from multiprocessing import Pool
+from multiprocessing.dummy import Pool as ThreadPool
+from oss2 import ObjectIterator
 from jinja2 import Template
-from customizedYAML import folded_unicode, literal_unicode, include_constructor
+from customizedYAML import folded_unicode, literal_unicode, include_constructor, include_key, INCLUDE_STACK
 from colorMessage import dyeWARNING, dyeFAIL
 from core import models
-from core.ali.oss import BUCKET
+from core.ali.oss import BUCKET, crc64, md5 as md5sum, upload_file
 from core.db import DB
+from core.misc import thread_map
 from app import App
 
 
+def buildAppInProcess(app_builds):
+    (app, builds) = app_builds
+    for kwargs in builds:
+        app.build(**kwargs)
+    return app
+
+
 class WorkflowParameter(object):
     """docstring for WorkflowParameter"""
     def __init__(self, workflow_path, project_path, value_file=None):
@@ -188,6 +202,7 @@ class Pipe(dict):
         self.db_path = None
         self.engine = None
         self.session = None
+        self.snapshot_key = None
 
     def new(self):
         pass
@@ -236,14 +251,51 @@ class Pipe(dict):
         print "upgraded to {version}, available versions: {tags}".format(version=latest.name, tags=tags)
         return latest.name
 
-    def deploy(self, destination, version=None):
-        def upload(key, filename, consumed, total):
-            BUCKET.put_object_from_file(key, filename)
-            if total:
-                rate = 100 * consumed / total
-                bar = '=' * (rate / 2)
-                sys.stdout.write("\r{0}% {1}".format(rate, bar))
-                sys.stdout.flush()
+    def deploy(self, destination, version=None, threads=10):
+        def is_uploaded((key, filename)):
+            stat = os.stat(filename)
+            obj = objects.get(key)
+            if obj is None or obj.size != stat.st_size:
+                return False
+            if manifest.get(key) == [stat.st_size, stat.st_mtime, obj.etag]:
+                return True
+            if '-' in obj.etag:
+                crc = BUCKET.head_object(key).headers.get('x-oss-hash-crc64ecma')
+                uploaded = crc is not None and int(crc) == crc64(filename)
+            else:
+                uploaded = md5sum(filename) == obj.etag.lower()
+            if uploaded:
+                manifest[key] = [stat.st_size, stat.st_mtime, obj.etag]
+            return uploaded
+
+        def upload((key, filename)):
+            stat = os.stat(filename)
+            result = upload_file(key, filename)
+            return key, [stat.st_size, stat.st_mtime, result.etag]
+
+        def show_progress():
+            rate = 100 * done[0] / total if total else 100
+            bar = '=' * (rate / 2)
+            sys.stdout.write("\r{0}% {1}".format(rate, bar))
+            sys.stdout.flush()
+
+        def load_manifest():
+            if not os.path.exists(manifest_file):
+                return {}
+            try:
+                with open(manifest_file) as f:
+                    return json.load(f)
+            except ValueError, e:
+                print dyeWARNING('Broken deploy manifest %s: %s' % (manifest_file, e))
+                return {}
+
+        def dump_manifest():
+            if not os.path.exists(os.path.dirname(manifest_file)):
+                os.makedirs(os.path.dirname(manifest_file))
+            tmp_file = '%s.%d' % (manifest_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump({k: manifest[k] for k in keys if k in manifest}, f)
+            os.rename(tmp_file, manifest_file)
 
         if not version:
             repo = git.Repo(self.pipe_path)
@@ -262,8 +314,31 @@ class Pipe(dict):
         pipe_name = os.path.basename(self.pipe_path)
         pipe_path = self.pipe_path + '/'
         keys = map(lambda x:os.path.join(destination, pipe_name, version, x.replace(pipe_path, '')), files2upload)
+        prefix = os.path.join(destination, pipe_name, version, '')
+        objects = {obj.key: obj for obj in ObjectIterator(BUCKET, prefix=prefix, max_keys=1000)}
+        manifest_file = os.path.expanduser(os.path.join('~/.snap/cache/deploy', pipe_name, version + '.json'))
+        manifest = load_manifest()
+
+        # only files missing in the manifest are hashed
+        uploaded = thread_map(is_uploaded, zip(keys, files2upload), threads)
+        to_upload = [x for x, is_done in zip(zip(keys, files2upload), uploaded) if not is_done]
         total = len(files2upload)
-        map(upload, keys, files2upload, xrange(1, total+1), [total]*total)
+        done = [total - len(to_upload)]
+        show_progress()
+        if to_upload:
+            pool = ThreadPool(min(threads, len(to_upload)))
+            try:
+                for key, record in pool.imap_unordered(upload, to_upload):
+                    manifest[key] = record
+                    done[0] += 1
+                    show_progress()
+                pool.close()
+            finally:
+                pool.terminate()
+                dump_manifest()
+        else:
+            dump_manifest()
+        print "\n{uploaded} files uploaded, {skipped} unchanged.".format(uploaded=len(to_upload), skipped=total - len(to_upload))
 
     def destroy(self, bucket='', destination='', version=''):
         shutil.rmtree(self.pipe_path)
@@ -273,12 +348,13 @@ class Pipe(dict):
             cmdline = 'ossutil rm -r ' + to_delete
             os.system(cmdline)
 
-    def loadPipe(self):
+    def loadPipe(self, cache=False):
         def isApp(files):
             return 'config.yaml' in files
 
         def loadAPP(app_path):
             app = App(app_path)
+            read_files.extend([os.path.join(app_path, 'config.yaml'), os.path.join(app_path, '.appid')])
             try:
                 app.load()
             # except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
@@ -292,35 +368,115 @@ class Pipe(dict):
             return 'dependencies.yaml' in files
 
         def loadDependency(root):
+            read_files.append(os.path.join(root, 'dependencies.yaml'))
             depend = self.loadYaml(os.path.join(root, 'dependencies.yaml'))
             module = depend.pop('name')
             self.dependencies[module] = depend
 
-        excludes = ['example', 'database', 'software', '.git']
-        for root, dirs, files in os.walk(self.pipe_path, topdown=True, followlinks=True):
-            dirs[:] = [d for d in dirs if d not in excludes]
-            if isApp(files):
-                app = loadAPP(root)
-                if app.appname:
-                    self.apps[app.appname] = app
-                    dirs[:] = []
-                    continue
-                else:
-                    raise IOError("%s is not valid app" % root)
-
-            if isDependency(files):
-                loadDependency(root)
+        def fileState(path):
+            path = os.path.realpath(path)
+            if os.path.exists(path):
+                return include_key(path)
+            return (path, )
+
+        if cache and self.loadSnapshot():
+            return
+
+        # files read by the walk and everything they !include, gitignored or outside the repo ones too
+        read_files = []
+        INCLUDE_STACK.append([])
+        try:
+            excludes = ['example', 'database', 'software', '.git']
+            for root, dirs, files in os.walk(self.pipe_path, topdown=True, followlinks=True):
+                dirs[:] = [d for d in dirs if d not in excludes]
+                if isApp(files):
+                    app = loadAPP(root)
+                    if app.appname:
+                        self.apps[app.appname] = app
+                        dirs[:] = []
+                        continue
+                    else:
+                        raise IOError("%s is not valid app" % root)
+
+                if isDependency(files):
+                    loadDependency(root)
+        finally:
+            included = INCLUDE_STACK.pop()
+
+        if cache:
+            self.dumpSnapshot(sorted(set(map(fileState, read_files) + included)))
+
+    def snapshotKey(self):
+        def gitState(repo, prefix=''):
+            def fileStat(line):
+                path = os.path.join(repo.working_tree_dir, line[3:].split(' -> ')[-1].strip('"'))
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    return (prefix + line, stat.st_mtime, stat.st_size)
+                return (prefix + line, )
+
+            status = repo.git.status('--porcelain', '--untracked-files=all').splitlines()
+            state = [(prefix, repo.head.commit.hexsha)] + map(fileStat, status)
+            for submodule in repo.submodules:
+                if submodule.module_exists():
+                    state.extend(gitState(submodule.module(), os.path.join(prefix, submodule.path) + '/'))
+            return state
+
+        try:
+            repo = git.Repo(self.pipe_path)
+        except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+            return None
+        # snapshots pickle App objects, so they expire with the code as well
+        code = [os.path.getmtime(sys.modules[m].__file__) for m in (App.__module__, __name__)]
+        return (os.path.realpath(self.pipe_path), code, gitState(repo))
+
+    def snapshotFile(self):
+        snapshot_path = os.path.expanduser('~/.snap/cache/pipe')
+        if not os.path.exists(snapshot_path):
+            os.makedirs(snapshot_path)
+        return os.path.join(snapshot_path, hashlib.md5(os.path.realpath(self.pipe_path)).hexdigest() + '.pkl')
+
+    def loadSnapshot(self):
+        self.snapshot_key = self.snapshotKey()
+        if self.snapshot_key is None or not os.path.exists(self.snapshotFile()):
+            return False
+        try:
+            with open(self.snapshotFile(), 'rb') as f:
+                (key, files, apps, dependencies) = pickle.load(f)
+        except Exception, e:
+            print dyeWARNING('Broken pipeline snapshot: %s' % e)
+            return False
+        if key != self.snapshot_key or not all([self.isFileUnchanged(f) for f in files]):
+            return False
+        self.apps = apps
+        self.dependencies = dependencies
+        return True
+
+    def isFileUnchanged(self, state):
+        path = state[0]
+        if not os.path.exists(path):
+            return len(state) == 1
+        return include_key(path) == state
+
+    def dumpSnapshot(self, files):
+        if self.snapshot_key is None:
+            return
+        snapshot_file = self.snapshotFile()
+        tmp_file = '%s.%d' % (snapshot_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((self.snapshot_key, files, self.apps, self.dependencies), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, snapshot_file)
 
     def build(self, parameter_file=None, proj_path=None,
               pymonitor_path='monitor', proj_name=None,
               queue='all.q', priority='RD_test',
-              overwrite = False, verbose=False):
+              overwrite = False, verbose=False, jobs=1, cache=True):
         if proj_path:
             self.proj_path = os.path.abspath(proj_path)
         self.verbose = verbose
         self.loadParameters(parameter_file)
-        self.loadPipe()
-        self.buildApps()
+        self.loadPipe(cache)
+        self.buildApps(jobs)
         self.buildDB(overwrite)
         self.buildDepends()
         self.makePymonitorSH(pymonitor_path, proj_name, queue, priority)
@@ -337,7 +493,7 @@ class Pipe(dict):
         db.mkOssSyncSH()
         db.add()
 
-    def buildApps(self):
+    def buildApps(self, jobs=1):
         def buildEachApp(parameters, module, appname):
             if not self.dependencies.has_key(module):
                 raise KeyError('dependencies.yaml has no {module}'.format(module=module))
@@ -363,19 +519,38 @@ class Pipe(dict):
 
             self.checkAppAlias(module, appname)
             self.updateResourceConfig(module, appname)
-            self.apps[appname].build(parameters=parameters, module=module, output=sh_file, verbose=self.verbose)
+            kwargs = dict(parameters=parameters, module=module, output=sh_file, verbose=self.verbose)
+            if jobs > 1:
+                builds[appname].append(kwargs)
+            else:
+                self.apps[appname].build(**kwargs)
 
         def buildEachModule(module):
             module_param = dict([(k, self.parameters[k]) for k in ('Samples', 'Groups', 'CommonData', 'CommonParameters', module)])
             for appname in self.parameters[module].keys():
                 buildEachApp(module_param.copy(), module, appname)
 
+        def buildInPool():
+            # an app built in several modules keeps its scripts in order, so each app goes to one process
+            appnames = sorted(builds.keys())
+            pool = Pool(min(jobs, len(appnames)))
+            try:
+                apps = pool.map(buildAppInProcess, [(self.apps[appname], builds[appname]) for appname in appnames], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            self.apps.update(zip(appnames, apps))
+
+        builds = defaultdict(list)
         for k, v in self.parameters.iteritems():
             if v is None:
                 raise ValueError('Module "{module}" contains no app!'.format(module=k))
             if k not in ('Samples', 'Groups', 'CommonData', 'CommonParameters'):
                 buildEachModule(k)
 
+        if builds:
+            buildInPool()
+
     def checkAppAlias(self, module, appname):
         if appname not in self.apps:
             source = self.dependencies[module][appname].get('alias')
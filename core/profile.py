@@ -11,15 +11,17 @@ import plotly
 import os
 import pdb
 import itertools
+from core.store import SUMMARY_COLUMNS
+from core.downsample import AGGREGATIONS, downsample, zoom_owner, selection_zoom
 
 app = dash.Dash()
 
 app.scripts.config.serve_locally = True
 
-profile_file = os.path.expanduser("~/.snap/profile.pkl")
-profiles = pd.read_pickle(profile_file)
-profiles.Time = profiles.Time.astype('int64')
-column_options = [{'label': c , 'value':c} for c in profiles.columns.values.tolist() if c != 'index']
+MAX_POINTS = 2000
+store = None
+task_ids = None
+program_color = {}
 
 def color_palette(elements, ptype='qual', palette='Paired'):
     n_element = len(elements)
@@ -35,95 +37,140 @@ def color_palette(elements, ptype='qual', palette='Paired'):
     colors = cl.to_rgb(colors)
     return dict(zip(elements, colors))
 
-program_color = color_palette(profiles.Program.unique())
 overview_color = color_palette(['%CPU', '%MEM', 'disk'], 'qual', 'Pastel1')
-ctrl_style = {'width': '14%', 'display': 'inline-block', 'margin': '1'}
-
-app.layout = html.Div([
-    html.H4('Task Profile'),
-    dt.DataTable(
-        rows=profiles.to_dict('records'),
-
-        # optional - sets the order of columns
-        columns=sorted(profiles.columns),
-
-        row_selectable=True,
-        filterable=True,
-        sortable=True,
-        selected_row_indices=[],
-        id='datatable-profiles'
-    ),
-    html.Div(id='selected-indexes'),
-    html.Hr(),
-    html.Div([
-        html.Div([
-            html.Label('Show:'),
-            dcc.RadioItems(
-                options = [{'label': 'Overview', 'value': True}, {'label': 'Detail', 'value': False}],
-                value = True,
-                id = 'overview')
-        ], style={'width': '10%', 'float': 'left', 'margin': '1'}),
-        html.Div([
-            html.Label('X-axis'),
-            dcc.Dropdown(
-                options = column_options,
-                placeholder = 'Xaxis',
-                value = 'Time',
-                id = 'xaxis')
-        ], style = ctrl_style),
-        html.Div([
-            html.Label('Y-axis'),
-            dcc.Dropdown(
-                options = column_options,
-                value = '%CPU',
-                id = 'yaxis')
-        ], style = ctrl_style),
-        html.Div([
-            html.Label('Size'),
-            dcc.Dropdown(
-                options = column_options,
-                value = None,
-                id = 'size_mapper')
-        ], style = ctrl_style),
-        html.Div([
-            html.Label('Type'),
-            dcc.Dropdown(
-                options = map(lambda x:{'label':x, 'value':x}, ['scatter', 'box']),
-                value = 'scatter',
-                id = 'figure_type')
-        ], style = ctrl_style),
-        html.Div([
-            html.Label('Mode'),
-            dcc.Dropdown(
-                options = map(lambda x:{'label':x, 'value':x}, ['markers', 'lines', 'markers+lines']),
-                value = 'markers+lines',
-                id = 'figure_mode')
-        ], style = ctrl_style),
+ctrl_style = {'width': '12%', 'display': 'inline-block', 'margin': '1'}
+
+def make_layout(summary, column_options):
+    return html.Div([
+        html.H4('Task Profile'),
+        dt.DataTable(
+            rows=summary.to_dict('records'),
+
+            # optional - sets the order of columns
+            columns=list(summary.columns),
+
+            row_selectable=True,
+            filterable=True,
+            sortable=True,
+            selected_row_indices=[],
+            id='datatable-profiles'
+        ),
+        html.Div(id='selected-indexes'),
+        html.Hr(),
         html.Div([
-            html.Label('Height'),
-            dcc.Slider(
-                min = 120, max=800, step=20, value=180,
-                id = 'height')
-        ], style = ctrl_style),
-    ]),
-    html.Hr(),
-    dcc.Graph(
-        id='graph-profiles'
-    ),
-], className="container")
+            html.Div([
+                html.Label('Show:'),
+                dcc.RadioItems(
+                    options = [{'label': 'Overview', 'value': True}, {'label': 'Detail', 'value': False}],
+                    value = True,
+                    id = 'overview')
+            ], style={'width': '10%', 'float': 'left', 'margin': '1'}),
+            html.Div([
+                html.Label('X-axis'),
+                dcc.Dropdown(
+                    options = column_options,
+                    placeholder = 'Xaxis',
+                    value = 'Time',
+                    id = 'xaxis')
+            ], style = ctrl_style),
+            html.Div([
+                html.Label('Y-axis'),
+                dcc.Dropdown(
+                    options = column_options,
+                    value = '%CPU',
+                    id = 'yaxis')
+            ], style = ctrl_style),
+            html.Div([
+                html.Label('Size'),
+                dcc.Dropdown(
+                    options = column_options,
+                    value = None,
+                    id = 'size_mapper')
+            ], style = ctrl_style),
+            html.Div([
+                html.Label('Type'),
+                dcc.Dropdown(
+                    options = map(lambda x:{'label':x, 'value':x}, ['scatter', 'box']),
+                    value = 'scatter',
+                    id = 'figure_type')
+            ], style = ctrl_style),
+            html.Div([
+                html.Label('Mode'),
+                dcc.Dropdown(
+                    options = map(lambda x:{'label':x, 'value':x}, ['markers', 'lines', 'markers+lines']),
+                    value = 'markers+lines',
+                    id = 'figure_mode')
+            ], style = ctrl_style),
+            html.Div([
+                html.Label('Sampling'),
+                dcc.Dropdown(
+                    options = map(lambda x:{'label':x, 'value':x}, AGGREGATIONS),
+                    value = 'lttb',
+                    id = 'sampling')
+            ], style = ctrl_style),
+            html.Div([
+                html.Label('Height'),
+                dcc.Slider(
+                    min = 120, max=800, step=20, value=180,
+                    id = 'height')
+            ], style = ctrl_style),
+        ]),
+        html.Hr(),
+        dcc.Graph(
+            id='graph-profiles'
+        ),
+        html.Div(id='zoom-owner', style={'display': 'none'}),
+    ], className="container")
 
+app.layout = make_layout(pd.DataFrame(columns=SUMMARY_COLUMNS), [])
+
+def serve(profile_store, tasks=None, **kwargs):
+    global store, task_ids, program_color
+    store = profile_store
+    task_ids = tasks
+    summary = store.summary(task_ids)
+    column_options = [{'label': c , 'value':c} for c in store.numeric_columns(task_ids) if c != 'index']
+    program_color = color_palette(summary.Program.unique())
+    app.layout = make_layout(summary, column_options)
+    app.run_server(**kwargs)
+
+# relayoutData keeps the last zoom when rows or xaxis change, the figure is
+# redrawn through zoom-owner on those changes so the old zoom is ignored
 @app.callback(
-    Output('graph-profiles', 'figure'),
+    Output('zoom-owner', 'children'),
     [Input('datatable-profiles', 'rows'),
-     Input('overview', 'value'),
+     Input('xaxis', 'value')],
+    [State('graph-profiles', 'relayoutData')])
+def update_zoom_owner(rows, xaxis_column, relayout):
+    pairs = sorted(set([(r['file'], r['Program']) for r in rows or []]))
+    return zoom_owner([pairs, xaxis_column], relayout)
+
+@app.callback(
+    Output('graph-profiles', 'figure'),
+    [Input('overview', 'value'),
      Input('height', 'value'),
-     Input('xaxis', 'value'),
      Input('yaxis', 'value'),
      Input('size_mapper', 'value'),
      Input('figure_type', 'value'),
      Input('figure_mode', 'value'),
+     Input('sampling', 'value'),
+     Input('graph-profiles', 'relayoutData'),
+     Input('zoom-owner', 'children'),
+    ],
+    [State('datatable-profiles', 'rows'),
+     State('xaxis', 'value'),
     ])
-def update_figure(rows, overview, height, xaxis_column, yaxis_column, size_column, ftype, fmode):
+def update_figure(overview, height, yaxis_column, size_column, ftype, fmode, sampling, relayout, owner, rows, xaxis_column):
+    def sample(df, x_column, y_column):
+        # only time series are bucketed, scatters and boxes keep every n-th point
+        if x_column == 'Time' and ftype == 'scatter' and not size_column:
+            x, y = downsample(df[x_column].values, df[y_column].values, MAX_POINTS, sampling or 'lttb')
+            return pd.Series(x), y
+        step = int(np.ceil(len(df) / float(MAX_POINTS)))
+        if step > 1:
+            df = df.iloc[::step]
+        return df[x_column], df[y_column]
+
     def add_file_trace(fig, filename, row_idx, col_idx=1):
         file_trace = make_file_trace(filename)
         if overview:
@@ -148,16 +195,21 @@ def update_figure(rows, overview, height, xaxis_column, yaxis_column, size_colum
         overview_df = overview_df.agg({'%CPU': 'sum', '%MEM': 'sum', 'disk': 'max'})
         overview_df.index.name = 'Time'
         overview_df.reset_index(inplace=True)
-        get_column_data = lambda column: {
-            'name': column, 'type': 'scatter', 'fill': 'tonexty',
-            'marker': {'color': overview_color[column]},
-            'x': overview_df.Time, 'y': overview_df[column]}
+
+        def get_column_data(column):
+            x, y = downsample(overview_df.Time.values, overview_df[column].values, MAX_POINTS, sampling or 'lttb')
+            return {
+                'name': column, 'type': 'scatter', 'fill': 'tonexty',
+                'marker': {'color': overview_color[column]},
+                'x': pd.Series(x), 'y': y}
 
         return map(get_column_data, ('%CPU', '%MEM', 'disk'))
 
     def make_program_trace(file_df, program):
         program_trace = file_df[file_df.Program == program]
         if size_column:
+            step = int(np.ceil(len(program_trace) / float(MAX_POINTS)))
+            program_trace = program_trace.iloc[::step]
             scaled_size = 12 * (0.5 + (program_trace[size_column] - dff[size_column].min()) / dff[size_column].max())
         else:
             scaled_size = 6
@@ -166,17 +218,36 @@ def update_figure(rows, overview, height, xaxis_column, yaxis_column, size_colum
             'type': ftype,
             'name': program}
 
-        if xaxis_column:
+        if xaxis_column and yaxis_column:
+            data['x'], data['y'] = sample(program_trace, xaxis_column, yaxis_column)
+        elif xaxis_column:
             data['x'] = program_trace[xaxis_column]
-        if yaxis_column:
+        elif yaxis_column:
             data['y'] = program_trace[yaxis_column]
         if ftype == 'scatter':
             data['mode'] = fmode
 
         return data
 
-    dff = pd.DataFrame(rows)
-    dff.Time = dff.Time.astype('timedelta64[ns]') + pd.to_datetime('1970/01/01')
+    if not rows:
+        return {'data': [], 'layout': {}}
+    pairs = set([(r['file'], r['Program']) for r in rows])
+    columns = set(['file', 'Program', 'Time', '%CPU', '%MEM', 'data', 'sys', xaxis_column, yaxis_column, size_column]) - set([None])
+    epoch = pd.to_datetime('1970/01/01')
+    zoomed = selection_zoom(relayout, owner) if xaxis_column == 'Time' else None
+    if zoomed:
+        start, end = [(pd.to_datetime(t) - epoch).value for t in zoomed]
+    else:
+        start, end = None, None
+    dff = store.query(
+        tasks = set([r['Task'] for r in rows]),
+        columns = columns,
+        where = {'file': set([p[0] for p in pairs]), 'Program': set([p[1] for p in pairs])},
+        start = start, end = end)
+    if dff.empty:
+        return {'data': [], 'layout': {}}
+    dff = dff[dff.set_index(['file', 'Program']).index.isin(pairs)].reset_index(drop=True)
+    dff.Time = dff.Time + epoch
     filenames = dff.file.unique()
     if overview:
         ncol = 3
@@ -191,6 +262,8 @@ def update_figure(rows, overview, height, xaxis_column, yaxis_column, size_colum
 
     [add_file_trace(fig, filename, i) for i, filename in enumerate(filenames, start=1)]
     fig['layout']['height'] = height * len(filenames)
+    if zoomed:
+        [fig['layout'][k].update(range=list(zoomed)) for k in fig['layout'] if k.startswith('xaxis')]
     max_nchar = max(map(len, dff.Program))
     fig['layout']['margin'] = {
         'l': 8 * max_nchar,
@@ -0,0 +1,64 @@
+from collections import defaultdict
+
+DONE = ('finished', 'cleaned')
+ACTIVE = ('waiting', 'running')
+TO_CHECK = ('created', 'failed')
+
+
+class Scheduler(object):
+    """In-memory task states and dependence in-degrees of a project.
+
+    A pending task is ready once all of its dependencies are done, so a sync
+    only needs to touch active, created, failed and ready tasks.
+    """
+    def __init__(self, states, depends):
+        super(Scheduler, self).__init__()
+        self.states = {}
+        self.by_state = defaultdict(set)
+        self.depend_by = defaultdict(list)
+        self.indegree = defaultdict(int)
+        self.ready = set()
+        for task_id, state in states:
+            self.states[task_id] = state
+            self.by_state[state].add(task_id)
+        for task_id, depend_task_id in depends:
+            self.depend_by[depend_task_id].append(task_id)
+            if self.states.get(depend_task_id) not in DONE:
+                self.indegree[task_id] += 1
+        self.ready = set([t for t in self.by_state['pending'] if self.is_ready(t)])
+
+    def is_ready(self, task_id):
+        return self.indegree[task_id] == 0
+
+    def update(self, task_id, state):
+        old_state = self.states.get(task_id)
+        self.states[task_id] = state
+        self.by_state[old_state].discard(task_id)
+        self.by_state[state].add(task_id)
+        if old_state not in DONE and state in DONE:
+            map(self.release, self.depend_by[task_id])
+        elif old_state in DONE and state not in DONE:
+            map(self.block, self.depend_by[task_id])
+
+        if state == 'pending' and self.is_ready(task_id):
+            self.ready.add(task_id)
+        else:
+            self.ready.discard(task_id)
+
+    def release(self, task_id):
+        self.indegree[task_id] -= 1
+        if self.is_ready(task_id) and self.states.get(task_id) == 'pending':
+            self.ready.add(task_id)
+
+    def block(self, task_id):
+        self.indegree[task_id] += 1
+        self.ready.discard(task_id)
+
+    def select(self, states):
+        return sorted(set().union(*[self.by_state[s] for s in states]))
+
+    def to_sync(self):
+        return self.select(ACTIVE)
+
+    def to_check(self):
+        return sorted(set(self.select(TO_CHECK)) | self.ready)
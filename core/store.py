@@ -0,0 +1,160 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+PROFILE_ROOT = os.path.expanduser('~/.snap/profile')
+SUMMARY_COLUMNS = ['Task', 'App', 'Module', 'Instance', 'file', 'Program', 'samples', 'duration', 'max %CPU', 'max %MEM']
+
+
+class ProfileStore(object):
+    """Task profiles of a project, saved column by column.
+
+    Each task is a partition under <root>/<project>/<app>/<task id>/, with one
+    .npy file per column and a meta.json holding the column names, the
+    signature of the profiled logs, a per program summary and the categories
+    of string columns, which are saved as int32 codes. Columns are memory
+    mapped on read, a query only materializes the rows it selects. A task
+    whose logs hold no profile is saved as a partition without rows, so its
+    signature still spares parsing the logs again.
+    """
+    def __init__(self, project, root=PROFILE_ROOT):
+        super(ProfileStore, self).__init__()
+        self.project = project
+        self.path = os.path.join(root, project)
+
+    def __repr__(self):
+        return "<ProfileStore(project={project}, path={path})>".format(project=self.project, path=self.path)
+
+    def partition_path(self, app, task_id):
+        return os.path.join(self.path, app, str(task_id))
+
+    def partitions(self, tasks=None, apps=None):
+        if not os.path.exists(self.path):
+            return []
+        partitions = []
+        for app in os.listdir(self.path):
+            if apps and app not in apps:
+                continue
+            for task_id in os.listdir(os.path.join(self.path, app)):
+                if not task_id.isdigit():
+                    continue
+                if tasks is not None and int(task_id) not in tasks:
+                    continue
+                partitions.append((app, int(task_id)))
+        return sorted(partitions, key=lambda x:x[1])
+
+    def meta(self, app, task_id):
+        meta_file = os.path.join(self.partition_path(app, task_id), 'meta.json')
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file) as f:
+            return json.load(f)
+
+    def signature(self, app, task_id):
+        meta = self.meta(app, task_id)
+        if meta is None:
+            return None
+        return meta['signature']
+
+    def remove(self, task_id):
+        for app, _ in self.partitions(tasks=[task_id]):
+            shutil.rmtree(self.partition_path(app, task_id))
+
+    def write(self, app, task_id, profiles, signature=None):
+        """Save profiles of a task, None or an empty DataFrame saves a partition without rows."""
+        def summarize():
+            groups = profiles.assign(seconds = profiles.Time / np.timedelta64(1, 's')).groupby(['file', 'Program'])
+            summary = pd.DataFrame({
+                'samples': groups.size(),
+                'duration': groups.seconds.max(),
+                'max %CPU': groups['%CPU'].max(),
+                'max %MEM': groups['%MEM'].max()}).reset_index()
+            summary['Task'] = task_id
+            for column in ['App', 'Module', 'Instance']:
+                summary[column] = profiles[column].iloc[0] if column in profiles and len(profiles) else None
+            return json.loads(summary[SUMMARY_COLUMNS].to_json(orient='records'))
+
+        if profiles is None:
+            profiles = pd.DataFrame()
+        path = self.partition_path(app, task_id)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        meta = {'signature': signature, 'rows': len(profiles), 'columns': [], 'categories': {}, 'summary': summarize() if len(profiles) else []}
+        for idx, column in enumerate(profiles.columns):
+            values = profiles[column].values
+            if values.dtype == object:
+                codes, categories = pd.factorize(values)
+                meta['categories'][column] = categories.tolist()
+                values = codes.astype(np.int32)
+            meta['columns'].append(column)
+            np.save(os.path.join(tmp_path, '%d.npy' % idx), values)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        self.remove(task_id)
+        os.rename(tmp_path, path)
+
+    def load_column(self, app, task_id, meta, column):
+        idx = meta['columns'].index(column)
+        return np.load(os.path.join(self.partition_path(app, task_id), '%d.npy' % idx), mmap_mode='r')
+
+    def decode(self, meta, column, values):
+        categories = meta['categories'].get(column)
+        if categories is None:
+            return np.asarray(values)
+        categories = np.array(categories + [np.nan], dtype=object)
+        return categories[values]
+
+    def select(self, app, task_id, meta, where):
+        mask = np.ones(meta['rows'], dtype=bool)
+        for column, allowed in where.iteritems():
+            values = self.load_column(app, task_id, meta, column)
+            categories = meta['categories'].get(column)
+            if categories is not None:
+                allowed = [categories.index(v) for v in allowed if v in categories]
+            mask &= np.in1d(values, list(allowed))
+        return mask
+
+    def query(self, tasks=None, apps=None, columns=None, where=None, start=None, end=None):
+        """Return profiles of the partitions as one DataFrame.
+
+        `where` maps a column to the values to keep, `start` and `end` bound
+        Time. Only `columns` are loaded if given.
+        """
+        where = where or {}
+        frames = []
+        for app, task_id in self.partitions(tasks, apps):
+            meta = self.meta(app, task_id)
+            if not meta['rows']:
+                continue
+            mask = self.select(app, task_id, meta, where)
+            if start is not None or end is not None:
+                times = self.load_column(app, task_id, meta, 'Time')
+                if start is not None:
+                    mask &= times >= np.timedelta64(start, 'ns')
+                if end is not None:
+                    mask &= times <= np.timedelta64(end, 'ns')
+            if not mask.any():
+                continue
+            names = [c for c in meta['columns'] if columns is None or c in columns]
+            frames.append(pd.DataFrame(
+                dict([(c, self.decode(meta, c, self.load_column(app, task_id, meta, c)[mask])) for c in names]),
+                columns=names))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def summary(self, tasks=None, apps=None):
+        records = sum([self.meta(app, task_id)['summary'] for app, task_id in self.partitions(tasks, apps)], [])
+        return pd.DataFrame(records, columns=SUMMARY_COLUMNS)
+
+    def numeric_columns(self, tasks=None):
+        columns = []
+        for app, task_id in self.partitions(tasks):
+            meta = self.meta(app, task_id)
+            columns.extend([c for c in meta['columns'] if c not in meta['categories'] and c not in columns])
+        return columns
@@ -6,7 +6,6 @@ import os
 import logging
 import pdb
 import functools
-import commands
 from core.app import App
 from core.pipe import WorkflowParameter
 from core.pipe import Pipe
@@ -14,8 +13,7 @@ from core import models
 from core.formats import *
 from core.misc import *
 from core.db import DB
-from core.ali.price import app as price_app
-from core.gantt import app as gantt_app
+from core.customizedYAML import enable_include_cache
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import IntegrityError
@@ -48,6 +46,8 @@ def init_app(args):
     return app
 
 def build_app(args):
+    if not args.no_cache:
+        enable_include_cache()
     app = init_app(args)
     app.build(parameter_file=args.param, dependence_file=args.depend, debug=args.debug, output=args.out)
 
@@ -120,7 +120,7 @@ def deploy_pipe(args):
     pipe = Pipe(pipe_path)
     ali_yaml = os.path.expanduser("~/.snap/ali.conf")
     ali_conf = yaml2dict(ali_yaml)
-    pipe.deploy(ali_conf['pipeline_path'], args.version)
+    pipe.deploy(ali_conf['pipeline_path'], args.version, args.threads)
 
 def remove_pipe(args):
     check_pipe_exists(args.name)
@@ -162,6 +162,9 @@ def build_pipe(args):
         print >> sys.stderr, "Pipeline path is invalid"
         os._exit(0)
 
+    if not args.no_cache:
+        enable_include_cache()
+
     if args.param:
         pipe.build(parameter_file=args.param,
                    proj_path=args.out,
@@ -170,7 +173,9 @@ def build_pipe(args):
                    queue=args.queue,
                    priority=args.priority,
                    overwrite=args.overwrite,
-                   verbose = args.verbose)
+                   verbose = args.verbose,
+                   jobs = args.jobs,
+                   cache = not args.no_cache)
     else:
         print >> sys.stderr, "parameters.conf is missing."
         os._exit(0)
@@ -202,6 +207,19 @@ def sync_bcs(args):
         project = load_project(args.project)
         project.sync()
 
+def daemon_bcs(args):
+    def parse_project(project):
+        if ':' in project:
+            (name, interval) = project.rsplit(':', 1)
+            return name, int(interval)
+        else:
+            return project, args.interval
+
+    from core.daemon import SyncDaemon
+    projects = dict(map(parse_project, args.project or []))
+    daemon = SyncDaemon(db_yaml, projects, args.interval)
+    daemon.run()
+
 def stat_bcs(args):
     if not args.project:
         projects = [load_project(name) for name, dbfile in db.items()]
@@ -278,8 +296,9 @@ def cron_bcs(args):
 
 def clean_bcs(args):
     proj = load_project(args.project)
-    proj.clean_files(immediate = not args.all_files)
-    proj.clean_bcs()
+    proj.clean_files(immediate = not args.all_files, dry_run = args.dry_run, threads = args.threads)
+    if not args.dry_run:
+        proj.clean_bcs()
 
 def cost_bcs(args):
     proj = load_project(args.project)
@@ -299,9 +318,11 @@ def instance_bcs(args):
     print format_instance_tbl(instances, args.latest).get_string(sortby="price")
 
 def price_bcs(args):
+    from core.ali.price import app as price_app
     price_app.run_server(host='0.0.0.0', port=args.port)
 
 def gantt_bcs(args):
+    from core.gantt import app as gantt_app
     gantt_app.run_server(host='0.0.0.0', port=args.port)
 
 def inspect_bcs(args):
@@ -335,7 +356,7 @@ def load_project(name):
     return proj
 
 def new_session(name, dbfile):
-    engine = create_engine('sqlite:///' + dbfile)
+    engine = models.new_engine(dbfile)
     Session = sessionmaker(bind=engine)
     return Session()
 
@@ -411,7 +432,8 @@ def do_task(args, status, event):
             os._exit(0)
 
     if tasks:
-        map(lambda x: x.__getattribute__(event)(), tasks)
+        with proj.unit_of_work():
+            map(lambda x: proj.apply(x, lambda t: t.__getattribute__(event)()), tasks)
         msg = 'Task {ids} will be {event}.'.format(ids=ids, event=event)
         print msg
     else:
@@ -435,7 +457,8 @@ def kill_task(args):
     proj = load_project(args.project)
     tasks = proj.query_tasks(args)
     stop_task(args)
-    map(lambda x: x.kill(), tasks)
+    with proj.unit_of_work():
+        map(lambda x: proj.apply(x, lambda t: t.kill()), tasks)
 
 def sync_task(args):
     def sync_each_task(task):
@@ -458,11 +481,9 @@ def attach_task(args):
 def profile_task(args):
     proj = load_project(args.project)
     tasks = proj.query_tasks(args)
-    profiles = proj.profile(tasks)
-    profile_file = os.path.expanduser("~/.snap/profile.pkl")
-    profiles.to_pickle(profile_file)
-    from core.profile import app as profile_app
-    profile_app.run_server(host='0.0.0.0', port=args.port)
+    store = proj.profile(tasks, threads=args.threads, jobs=args.jobs, cache=not args.no_cache)
+    from core.profile import serve
+    serve(store, [t.id for t in tasks], host='0.0.0.0', port=args.port)
 
 def add_mapping(args):
     proj = load_project(args.project)
@@ -479,6 +500,7 @@ def query_mappings(args):
     else:
         mappings = proj.query_mappings(args, fuzzy=args.fuzzy)
 
+    proj.list_objects(mappings)
     if args.skip_existed:
         mappings = filter(lambda x:not is_mapping_existed(x), mappings)
     return mappings
@@ -521,11 +543,7 @@ def remove_mapping(args):
     proj.remove_mapping(args)
 
 def sync_mapping(args):
-    def check_ossutil_exist():
-        EXIT_CODE, OSSUTIL_PATH = commands.getstatusoutput('which ossutil')
-        if EXIT_CODE != 0:
-            print dyeWARNING('ossutil not found.')
-            os._exit(1)
+    from core.ali.transfer import Transfer
 
     def estimate_size():
         if args.estimate_size:
@@ -550,12 +568,16 @@ def sync_mapping(args):
             else:
                 os._exit(0)
 
-    check_ossutil_exist()
     mappings = query_mappings(args)
     estimate_size()
     question_overwrite()
 
-    map(lambda x: x.sync(overwrite=args.overwrite), mappings)
+    transfer = Transfer(args.threads)
+    map(lambda x: x.sync(overwrite=args.overwrite, transfer=transfer), mappings)
+    failed = transfer.run()
+    if failed:
+        print dyeFAIL("{count} files failed to sync.".format(count=len(failed)))
+        sys.exit(1)
 
 def create_cluster(args):
     kwargs = {k:v for k,v in args._get_kwargs() if k != 'func' and v is not None}
@@ -674,6 +696,7 @@ if __name__ == "__main__":
     subparsers_app_build.add_argument('-depend', help = "render defaults from dependencies.yaml file. ")
     subparsers_app_build.add_argument('-debug', action='store_true', help = "show debug render info.")
     subparsers_app_build.add_argument('-out', help = "output render result to file. default write to stdout")
+    subparsers_app_build.add_argument('-no_cache', default=False, action='store_true', help = "do not use cached yaml files under ~/.snap/cache")
     subparsers_app_build.set_defaults(func=build_app)
     #app run
     subparsers_app_run = subparsers_app.add_parser('run',
@@ -698,6 +721,7 @@ if __name__ == "__main__":
     subparsers_app_run.add_argument('-upload', default=False, action='store_true', help="Auto upload scripts")
     subparsers_app_run.add_argument('-all', default=False, action='store_true', help="Run all scripts")
     subparsers_app_run.add_argument('-show_json', default=False, action='store_true', help="Show json")
+    subparsers_app_run.add_argument('-threads', default=10, type=int, help="list and hash files to upload in N threads")
     subparsers_app_run.set_defaults(func=run_app)
     #app node
     subparsers_app_node = subparsers_app.add_parser('node',
@@ -790,6 +814,7 @@ if __name__ == "__main__":
         formatter_class=argparse.RawTextHelpFormatter)
     subparsers_pipe_deploy.add_argument('-name', required=True, help="the pipeline name")
     subparsers_pipe_deploy.add_argument('-version', help="the pipeline version")
+    subparsers_pipe_deploy.add_argument('-threads', default=10, type=int, help="upload files in N threads")
     subparsers_pipe_deploy.set_defaults(func=deploy_pipe)
 
     # pipe remove
@@ -829,6 +854,8 @@ if __name__ == "__main__":
     subparsers_pipe_build.add_argument('-out', help="output everything needed for a project")
     subparsers_pipe_build.add_argument('-overwrite', default=False, action='store_true', help="overwrite snap.db")
     subparsers_pipe_build.add_argument('-verbose', default=False, action='store_true', help="show more info.")
+    subparsers_pipe_build.add_argument('-jobs', default=1, type=int, help="render apps in N processes.")
+    subparsers_pipe_build.add_argument('-no_cache', default=False, action='store_true', help="do not use cached yaml files and pipeline snapshot under ~/.snap/cache")
     subparsers_pipe_build.set_defaults(func=build_pipe)
 
     # bcs
@@ -855,6 +882,15 @@ if __name__ == "__main__":
     subparsers_bcs_config.add_argument('-vpc_cidr_block', default='172.16.20.0/20', help="VPC cidr block for access other ECS instance.")
     subparsers_bcs_config.add_argument('-tmate_server', help="tmate server IP.")
     subparsers_bcs_config.add_argument('-benchmark_interval', help="tmate server IP.")
+    subparsers_bcs_config.add_argument('-poll_threads', type=int, help="How many jobs to poll concurrently when sync.")
+    subparsers_bcs_config.add_argument('-listing_ttl', type=int, help="Seconds to trust a cached OSS object listing.")
+    subparsers_bcs_config.add_argument('-price_ttl', type=int, help="Seconds to trust cached spot prices.")
+    subparsers_bcs_config.add_argument('-list_threads', type=int, help="How many OSS folders to list concurrently.")
+    subparsers_bcs_config.add_argument('-transfer_threads', type=int, help="How many files to copy concurrently in mapping sync.")
+    subparsers_bcs_config.add_argument('-multipart_threads', type=int, help="How many parts of one file to copy concurrently.")
+    subparsers_bcs_config.add_argument('-multipart_threshold', type=int, help="Upload files larger than this many bytes in parts.")
+    subparsers_bcs_config.add_argument('-multiget_threshold', type=int, help="Download files larger than this many bytes in parts.")
+    subparsers_bcs_config.add_argument('-connection_pool_size', type=int, help="HTTP connections kept to OSS, shared by copy threads.")
     subparsers_bcs_config.add_argument('-access_token', help="Access token for dingtalk notification")
     subparsers_bcs_config.add_argument('-mobile', help="mobile phone for dingtalk notification")
     subparsers_bcs_config.set_defaults(func=config_bcs)
@@ -908,6 +944,16 @@ if __name__ == "__main__":
     subparsers_bcs_sync.add_argument('-project', default=None, help="ContractID or ProjectID, sync all project in ~/.snap/db.yaml")
     subparsers_bcs_sync.set_defaults(func=sync_bcs)
 
+    # bcs daemon
+    subparsers_bcs_daemon = subparsers_bcs.add_parser('daemon',
+        help='Keep syncing task states with Aliyun BCS in one process.',
+        description="This command will keep projects loaded and sync them periodically, instead of crontab.",
+        prog='snap bcs daemon',
+        formatter_class=argparse.RawTextHelpFormatter)
+    subparsers_bcs_daemon.add_argument('-project', default=None, nargs="*", help="ContractID or ProjectID to sync, use `name:minutes` for its own interval. default will sync all project in ~/.snap/db.yaml")
+    subparsers_bcs_daemon.add_argument('-interval', default=15, type=int, help="default sync interval in minute")
+    subparsers_bcs_daemon.set_defaults(func=daemon_bcs)
+
     # bcs cron
     subparsers_bcs_cron = subparsers_bcs.add_parser('cron',
         help='Set Crontab for Aliyun BCS.',
@@ -929,6 +975,8 @@ if __name__ == "__main__":
         formatter_class=argparse.RawTextHelpFormatter)
     subparsers_bcs_clean.add_argument('-project', default=None, required=True, help="ContractID or ProjectID you want to clean")
     subparsers_bcs_clean.add_argument('-all_files', default=False, action='store_true', help="Delete all output files or just immediate files")
+    subparsers_bcs_clean.add_argument('-dry_run', default=False, action='store_true', help="Only show the number and size of files to be deleted")
+    subparsers_bcs_clean.add_argument('-threads', default=10, type=int, help="Number of threads listing and deleting files")
     subparsers_bcs_clean.set_defaults(func=clean_bcs)
 
     # bcs resume
@@ -1197,6 +1245,9 @@ if __name__ == "__main__":
         parents=[share_task_parser],
         formatter_class=argparse.RawTextHelpFormatter)
     subparsers_task_profile.add_argument('-port', default=8000, type=int, help="Port expose")
+    subparsers_task_profile.add_argument('-threads', default=10, type=int, help="download logs in N threads.")
+    subparsers_task_profile.add_argument('-jobs', default=None, type=int, help="parse logs in N processes, default is the number of cpus.")
+    subparsers_task_profile.add_argument('-no_cache', default=False, action='store_true', help="profile tasks again even if they are in ~/.snap/profile")
     subparsers_task_profile.set_defaults(func=profile_task)
 
     # mapping
@@ -1298,6 +1349,7 @@ if __name__ == "__main__":
     subparsers_mapping_sync.add_argument('-module', default=None, help="Task module")
     subparsers_mapping_sync.add_argument('-overwrite', default=False, action='store_true', help="overwrite snap.db")
     subparsers_mapping_sync.add_argument('-estimate_size', default=False, action='store_true', help="estimate sync data size")
+    subparsers_mapping_sync.add_argument('-threads', default=10, type=int, help="copy N files at the same time")
     subparsers_mapping_sync.set_defaults(func=sync_mapping)
 
     # cluster
@@ -0,0 +1,27 @@
+import subprocess
+import argparse
+import time
+import sys
+import os
+
+SNAP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snap.py')
+COMMANDS = ['-h', 'task list -h', 'task show -h', 'bcs sync -h', 'bcs instance -h', 'mapping list -h', 'pipe build -h']
+
+def timeit(cmd, repeat):
+    timing = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat):
+            start = time.time()
+            subprocess.call([sys.executable, SNAP] + cmd.split(), stdout=devnull, stderr=devnull)
+            timing.append(time.time() - start)
+    return timing
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure wall time of snap subcommands startup.')
+    parser.add_argument('-repeat', default=5, type=int, help="repeat times for each command")
+    parser.add_argument('-cmd', nargs='*', default=COMMANDS, help="subcommands to measure")
+    args = parser.parse_args()
+    print "{:<20}\t{:>8}\t{:>8}".format('command', 'min(s)', 'mean(s)')
+    for cmd in args.cmd:
+        timing = timeit(cmd, args.repeat)
+        print "{:<20}\t{:>8.3f}\t{:>8.3f}".format(cmd, min(timing), sum(timing) / len(timing))
@@ -1,5 +1,6 @@
-from core.app import App, AppParameter, AppFile
+from core.app import App, AppParameter, AppFile, render_template, TEMPLATE_CACHE
 import unittest
+from jinja2 import Template
 import shutil
 import pdb
 
@@ -248,5 +249,21 @@ class TestApp(unittest.TestCase):
         # pdb.set_trace()
         # self.app.dumpYaml(self.app.script, None)
 
+class TestRenderTemplate(unittest.TestCase):
+    """
+    test for compiled template cache
+    """
+    def test_plain_text(self):
+        for text in ['abc', 'abc\n', 'abc\n\n', 'a\r\nb\r\n', '', '{ a }', 'a}}b']:
+            self.assertEqual(render_template(text), Template(text).render())
+        self.assertNotIn('abc', TEMPLATE_CACHE)
+
+    def test_cached(self):
+        source = '{{ extra.sample }}/{{ extra.sample }}.bam'
+        self.assertEqual(render_template(source, extra={'sample': 'A'}), 'A/A.bam')
+        template = TEMPLATE_CACHE[source]
+        self.assertEqual(render_template(source, extra={'sample': 'B'}), 'B/B.bam')
+        self.assertIs(TEMPLATE_CACHE[source], template)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,74 @@
+from core.models import Base, Project, Bcs, new_engine
+from sqlalchemy.orm import sessionmaker
+import pandas as pd
+import unittest
+import tempfile
+import datetime
+import shutil
+import os
+
+def bill_line(resource, cost):
+    fields = [''] * 22
+    fields[11] = resource
+    fields[21] = str(cost)
+    return ','.join(fields) + '\n'
+
+class TestBilling(unittest.TestCase):
+    """
+    import bills of one day from billing_path/<date>/*.csv
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.home = os.environ.get('HOME')
+        os.environ['HOME'] = self.path
+        self.read_csv = pd.read_csv
+        self.session = sessionmaker(bind=new_engine(':memory:'))()
+        Base.metadata.create_all(self.session.get_bind())
+        self.project = Project(name='bill', start_date=datetime.datetime(2018, 5, 1), finish_date=datetime.datetime(2018, 5, 1))
+        self.project.session = self.session
+        self.session.add_all([self.project, Bcs(id='job-1'), Bcs(id='job-2')])
+        self.session.commit()
+        self.billing_path = os.path.join(self.path, 'billing')
+        os.makedirs(os.path.join(self.billing_path, '2018-05-01'))
+
+    def tearDown(self):
+        pd.read_csv = self.read_csv
+        os.environ['HOME'] = self.home
+        self.session.close()
+        shutil.rmtree(self.path)
+
+    def write_bill(self, name, lines):
+        with open(os.path.join(self.billing_path, '2018-05-01', name), 'w') as f:
+            f.writelines(lines)
+
+    def costs(self):
+        return {b.id: b.cost for b in self.session.query(Bcs).all()}
+
+    def test_empty_bill(self):
+        self.write_bill('empty.csv', [])
+        self.project.billing(self.billing_path)
+        self.assertEqual(self.costs(), {'job-1': 0, 'job-2': 0})
+
+    def test_multi_chunk_bill(self):
+        lines = [bill_line('job-1_task', 0.5)] * 100001
+        lines.append(bill_line('job-2_task', 2))
+        lines.append(bill_line('job-3_task', 4))
+        self.write_bill('big.csv', lines)
+        self.write_bill('empty.csv', [])
+        self.project.billing(self.billing_path)
+        self.assertAlmostEqual(self.costs()['job-1'], 50000.5)
+        self.assertEqual(self.costs()['job-2'], 2)
+
+    def test_cached_rerun(self):
+        self.write_bill('day.csv', [bill_line('job-1_task', 1), bill_line('job-1_task', 2)])
+        self.project.billing(self.billing_path)
+        self.assertEqual(self.costs(), {'job-1': 3, 'job-2': 0})
+
+        def read_csv(*args, **kwargs):
+            raise AssertionError('unchanged bill is read again')
+        pd.read_csv = read_csv
+        self.project.billing(self.billing_path)
+        self.assertEqual(self.costs(), {'job-1': 3, 'job-2': 0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+from core import customizedYAML
+import unittest
+import tempfile
+import shutil
+import yaml
+import os
+
+class TestRefer(unittest.TestCase):
+    """
+    test for !refer
+    """
+    def test_refer(self):
+        data = yaml.load("a:\n  b: 1\n  c: [1, 2]\nd: !refer a.b\ne: !refer a.c\nf: !refer d\n")
+        self.assertEqual(data['d'], 1)
+        self.assertEqual(data['f'], 1)
+        self.assertEqual(data['e'], [1, 2])
+        data['e'].append(3)
+        self.assertEqual(data['a']['c'], [1, 2])
+
+    def test_refer_before_defined(self):
+        data = yaml.load("x: [!refer y.z, 2]\ny:\n  z: {k: !refer w}\nw: v\n")
+        self.assertEqual(data['x'], [{'k': 'v'}, 2])
+        self.assertEqual(data['y']['z'], {'k': 'v'})
+
+    def test_circular(self):
+        self.assertRaises(ValueError, yaml.load, "a: !refer b\nb: !refer a\n")
+        self.assertRaises(ValueError, yaml.load, "a:\n  b: !refer a\n")
+
+class TestInclude(unittest.TestCase):
+    """
+    test for cached !include
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.write('common.yaml', 'cpu: 4\nmem: 8G\n')
+        self.write('defaults.yaml', 'resources: !include common.yaml\n')
+        self.write('config.yaml', 'a: !include defaults.yaml\nb: !include defaults.yaml\n')
+
+    def tearDown(self):
+        customizedYAML.INCLUDE_CACHE_DIR = None
+        shutil.rmtree(self.tmp)
+
+    def write(self, filename, content):
+        with open(os.path.join(self.tmp, filename), 'w') as f:
+            f.write(content)
+
+    def load(self):
+        with open(os.path.join(self.tmp, 'config.yaml')) as f:
+            return yaml.load(f)
+
+    def test_copy(self):
+        data = self.load()
+        self.assertEqual(data['a'], {'resources': {'cpu': 4, 'mem': '8G'}})
+        data['a']['resources']['cpu'] = 8
+        self.assertEqual(data['b']['resources']['cpu'], 4)
+        self.assertEqual(self.load()['a']['resources']['cpu'], 4)
+
+    def test_nested_change(self):
+        self.load()
+        self.write('common.yaml', 'cpu: 16\nmem: 8G\n')
+        self.assertEqual(self.load()['b']['resources']['cpu'], 16)
+
+    def test_pickle(self):
+        customizedYAML.enable_include_cache(os.path.join(self.tmp, 'cache'))
+        self.load()
+        customizedYAML.INCLUDE_CACHE.clear()
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp, 'cache'))), 2)
+        self.assertEqual(self.load()['a']['resources']['cpu'], 4)
+
+    def test_pickle_unicode_path(self):
+        customizedYAML.enable_include_cache(os.path.join(self.tmp, 'cache'))
+        path = u'/pipe/\u53c2\u6570.yaml'
+        self.assertEqual(customizedYAML.include_pickle(path), customizedYAML.include_pickle(path.encode('utf-8')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+from core.models import Project, Module, App, Task, Instance, Mapping
+from core.models import task_mapping_table, dependence_table
+from core.db import DB
+from StringIO import StringIO
+from argparse import Namespace
+import unittest
+import sys
+
+class TestMkTasks(unittest.TestCase):
+    """
+    tasks, mappings and task_mapping rows are bulk inserted and deduplicated
+    """
+    def setUp(self):
+        self.db = DB(':memory:', '/pipe', {}, {}, {})
+        self.db.proj = Project(name='proj-6')
+        module = Module(name='Filter_rRNA')
+        instance = Instance(name='bcs.a2.large', cpu=4, mem=8, price=0.4)
+        self.app = App(name='RMrRNA_SOAP2', module=module, instance=instance)
+        self.db.session.add_all([self.db.proj, self.app])
+        self.db.session.commit()
+
+    def tearDown(self):
+        self.db.session.close()
+
+    def mapping(self, name, destination, is_write=False):
+        return dict(name=name, source='/data/' + name, destination='oss://bucket/' + destination,
+            is_write=is_write, is_immediate=True, is_required=True)
+
+    def script(self, filename, *mappings):
+        task = dict(shell='/proj/' + filename, aasm_state='created', project_id=self.db.proj.id,
+            module_id=self.app.module_id, app_id=self.app.id, instance_id=self.app.instance_id)
+        return dict(filename=filename, mappings=list(mappings)), task
+
+    def build(self, *scripts):
+        self.db.task_rows = list(scripts)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.db.mkTasks()
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_build_twice(self):
+        ref = self.mapping('ref', 'ref/hg19.fa')
+        first = [
+            self.script('a.sh', self.mapping('sh', 'a.sh'), ref),
+            self.script('b.sh', self.mapping('sh', 'b.sh'), ref),
+            self.script('a.sh', self.mapping('sh', 'a.sh'))]
+        second = [
+            self.script('c.sh', ref, self.mapping('out', 'c/', is_write=True)),
+            self.script('a.sh', self.mapping('sh', 'a.sh'))]
+        output = self.build(*first)
+        self.assertEqual(output.count("'a.sh' not unique"), 1)
+        self.assertIn('2 tasks, 3 mappings added.', output)
+        output = self.build(*second)
+        self.assertEqual(output.count("'a.sh' not unique"), 1)
+        self.assertIn('1 tasks, 1 mappings added.', output)
+
+        session = self.db.session
+        tasks = {t.shell: t for t in session.query(Task).all()}
+        self.assertEqual(sorted(tasks.keys()), ['/proj/a.sh', '/proj/b.sh', '/proj/c.sh'])
+        self.assertEqual(session.query(Mapping).count(), 4)
+        self.assertEqual(session.query(task_mapping_table).count(), 6)
+        self.assertEqual(sorted([m.destination for m in tasks['/proj/c.sh'].mapping]), ['oss://bucket/c/', 'oss://bucket/ref/hg19.fa'])
+        self.assertEqual(len(set([m.id for t in tasks.values() for m in t.mapping if m.name == 'ref'])), 1)
+        for script, task in first + second:
+            self.assertTrue(script['task'] is tasks[task['shell']])
+
+class TestMkDepends(unittest.TestCase):
+    """
+    B depends on A of the same sample, C depends on B of every sample
+    """
+    def setUp(self):
+        parameters = {'Samples': [{'sample_name': 's1'}, {'sample_name': 's2'}], 'M': {'A': {}, 'B': {}, 'C': {}}}
+        dependencies = {'M': {
+            'A': {'depends': [], 'sh_file': '{{sample_name}}/a.sh'},
+            'B': {'depends': ['A'], 'sh_file': '{{sample_name}}/b.sh'},
+            'C': {'depends': ['B'], 'sh_file': 'c.sh'}}}
+        self.db = DB(':memory:', '/pipe', {}, parameters, dependencies)
+        # an earlier build in the same DB, its tasks must not be linked
+        self.build('proj-7')
+        self.tasks = self.build('proj-8')
+
+    def tearDown(self):
+        self.db.session.close()
+
+    def build(self, name):
+        session = self.db.session
+        self.db.proj = Project(name=name)
+        module = Module(name='M')
+        apps = {n: App(name=n, module=module) for n in 'ABC'}
+        self.db.apps = {n: Namespace(scripts=[]) for n in 'ABC'}
+        tasks = {}
+        for appname, sample_name in [('A', 's1'), ('A', 's2'), ('B', 's1'), ('B', 's2'), ('C', None)]:
+            task = Task(shell='/%s/%s/%s.sh' % (name, sample_name, appname), project=self.db.proj, module=module, app=apps[appname])
+            tasks[(appname, sample_name)] = task
+            extra = {'sample_name': sample_name} if sample_name else {}
+            self.db.apps[appname].scripts.append({'module': 'M', 'extra': extra, 'task': task})
+        session.add_all(tasks.values())
+        session.commit()
+        return tasks
+
+    def edges(self):
+        return set(self.db.session.query(dependence_table.c.task_id, dependence_table.c.depend_task_id).all())
+
+    def test_edges(self):
+        t = lambda appname, sample_name=None: self.tasks[(appname, sample_name)].id
+        expected = set([
+            (t('B', 's1'), t('A', 's1')),
+            (t('B', 's2'), t('A', 's2')),
+            (t('C'), t('B', 's1')),
+            (t('C'), t('B', 's2'))])
+        self.db.mkDepends()
+        self.assertEqual(self.edges(), expected)
+        self.db.mkDepends()
+        self.assertEqual(self.edges(), expected)
+
+if __name__ == '__main__':
+    unittest.main()
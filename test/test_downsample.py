@@ -0,0 +1,61 @@
+from core.downsample import aggregate, lttb, merge_intervals, zoom_range, zoom_owner, selection_zoom
+import numpy as np
+import unittest
+
+class TestAggregate(unittest.TestCase):
+    def setUp(self):
+        self.x = np.arange(10)
+        self.y = np.array([1, 5, 2, 2, np.nan, 8, 0, 3, 3, 3], dtype=float)
+
+    def test_buckets(self):
+        x, y = aggregate(self.x, self.y, 5, 'max')
+        self.assertEqual(x.tolist(), [0, 2, 4, 6, 8])
+        self.assertEqual(y.tolist(), [5, 2, 8, 3, 3])
+        x, y = aggregate(self.x, self.y, 5, 'min')
+        self.assertEqual(y.tolist(), [1, 2, 8, 0, 3])
+        x, y = aggregate(self.x, self.y, 5, 'mean')
+        self.assertEqual(y.tolist(), [3, 2, 8, 1.5, 3])
+
+    def test_short(self):
+        x, y = aggregate(self.x, self.y, 20, 'max')
+        self.assertEqual(len(x), 10)
+
+    def test_datetime(self):
+        x = np.datetime64('2018-03-01') + np.arange(10) * np.timedelta64(1, 'm')
+        bx, by = aggregate(x, self.y, 2, 'max')
+        self.assertEqual(bx.tolist(), x[[0, 5]].tolist())
+        self.assertEqual(by.tolist(), [5, 8])
+
+class TestLTTB(unittest.TestCase):
+    def test_keep_peaks(self):
+        x = np.arange(1000)
+        y = np.zeros(1000)
+        y[[100, 555, 800]] = [10, -10, 7]
+        dx, dy = lttb(x, y, 20)
+        self.assertEqual(len(dx), 20)
+        self.assertEqual(dx[0], 0)
+        self.assertEqual(dx[-1], 999)
+        self.assertTrue(set([100, 555, 800]) <= set(dx.tolist()))
+
+class TestMergeIntervals(unittest.TestCase):
+    def test_merge(self):
+        intervals = [(5, 7), (0, 2), (1, 3), (8, 9)]
+        self.assertEqual(merge_intervals(intervals, 0), [(0, 3), (5, 7), (8, 9)])
+        self.assertEqual(merge_intervals(intervals, 1), [(0, 3), (5, 9)])
+
+class TestZoomRange(unittest.TestCase):
+    def test_zoom(self):
+        self.assertIsNone(zoom_range(None))
+        self.assertIsNone(zoom_range({'xaxis.autorange': True}))
+        self.assertEqual(zoom_range({'xaxis2.range[0]': 1, 'xaxis2.range[1]': 2}), (1, 2))
+        self.assertEqual(zoom_range({'xaxis.range': [1, 2]}), (1, 2))
+
+    def test_selection_zoom(self):
+        zoom = {'xaxis.range': [1, 2]}
+        self.assertEqual(selection_zoom(zoom, None), (1, 2))
+        self.assertEqual(selection_zoom(zoom, zoom_owner(['a'], None)), (1, 2))
+        self.assertIsNone(selection_zoom(zoom, zoom_owner(['b'], zoom)))
+        self.assertEqual(selection_zoom({'xaxis.range': [3, 4]}, zoom_owner(['b'], zoom)), (3, 4))
+
+if __name__ == '__main__':
+    unittest.main()
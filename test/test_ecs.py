@@ -0,0 +1,67 @@
+from core.ali.ecs import PriceCache, TIME_FORMAT
+import unittest
+import tempfile
+import shutil
+import datetime
+import os
+
+class RecordedPriceCache(PriceCache):
+    """
+    PriceCache answering DescribeSpotPriceHistory with one price per hour
+    """
+    def __init__(self, *args, **kwargs):
+        super(RecordedPriceCache, self).__init__(*args, **kwargs)
+        self.requests = []
+
+    def fetch(self, instance_type, start, end):
+        self.requests.append((start, end))
+        hour = start.replace(minute=0, second=0, microsecond=0)
+        prices = []
+        while hour <= end:
+            if hour >= start:
+                prices.append({
+                    'InstanceType': instance_type, 'ZoneId': 'cn-beijing-a', 'NetworkType': 'vpc',
+                    'IoOptimized': True, 'Timestamp': hour.strftime(TIME_FORMAT),
+                    'OriginPrice': 1.0, 'SpotPrice': 0.1 * hour.hour})
+            hour += datetime.timedelta(hours=1)
+        return prices
+
+class TestPriceCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = RecordedPriceCache(os.path.join(self.path, 'price.db'), ttl=600)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_reuse(self):
+        latest = self.cache.history('ecs.sn1.medium')
+        self.assertEqual(self.cache.history('ecs.sn1.medium'), latest)
+        self.assertEqual(len(self.cache.requests), 1)
+        self.assertEqual(latest[-1]['InstanceType'], 'ecs.sn1.medium')
+
+    def test_fetch_missing_head(self):
+        self.cache.history('ecs.sn1.medium')
+        (start, end) = self.cache.requests[0]
+        prices = self.cache.history('ecs.sn1.medium', day=1)
+        self.assertEqual(len(self.cache.requests), 2)
+        self.assertEqual(self.cache.requests[1][1], start)
+        self.assertEqual(len(prices), 24)
+        self.cache.history('ecs.sn1.medium', day=1)
+        self.assertEqual(len(self.cache.requests), 2)
+
+    def test_fetch_expired_tail(self):
+        self.cache.history('ecs.sn1.medium')
+        self.cache.ttl = 0
+        self.cache.history('ecs.sn1.medium')
+        self.assertEqual(len(self.cache.requests), 2)
+        self.assertEqual(self.cache.requests[1][0], self.cache.requests[0][1])
+
+    def test_instance_types(self):
+        self.cache.history('ecs.sn1.medium')
+        self.cache.history('ecs.sn2.large')
+        self.assertEqual(len(self.cache.requests), 2)
+        self.assertTrue(all([p['InstanceType'] == 'ecs.sn2.large' for p in self.cache.history('ecs.sn2.large')]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+from core.misc import thread_map
+import unittest
+import threading
+
+class TestThreadMap(unittest.TestCase):
+    """
+    test for thread_map
+    """
+    def test_keep_order(self):
+        self.assertEqual(thread_map(lambda x: x * 2, range(50), 8), range(0, 100, 2))
+
+    def test_single_thread(self):
+        names = thread_map(lambda x: threading.current_thread().name, range(3), 1)
+        self.assertEqual(set(names), set([threading.current_thread().name]))
+
+    def test_empty(self):
+        self.assertEqual(thread_map(lambda x: x, [], 4), [])
+
+if __name__ == '__main__':
+    unittest.main()
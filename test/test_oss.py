@@ -0,0 +1,93 @@
+from core.ali.oss import ObjectListing, HashCache
+import unittest
+import tempfile
+import shutil
+import hashlib
+import time
+import os
+
+class TestObjectListing(unittest.TestCase):
+    """
+    test for ObjectListing without listing from oss
+    """
+    def setUp(self):
+        self.listing = ObjectListing(ttl=60)
+        self.listing.mark('project/p1/', time.time())
+        map(lambda x: self.listing.add(*x), [
+            ('project/p1/a/1.bam', 10),
+            ('project/p1/a/1.bam.bai', 1),
+            ('project/p1/b/2.bam', 20),
+            ('project/p1/b/empty', 0)])
+
+    def test_covers(self):
+        self.assertTrue(self.listing.covers('project/p1/a/'))
+        self.assertFalse(self.listing.covers('project/p2/a/'))
+        self.listing.mark('project/p1/', time.time() - 61)
+        self.assertFalse(self.listing.covers('project/p1/a/'))
+
+    def test_covers_nested(self):
+        self.listing.mark('project/', time.time() - 61)
+        self.listing.mark('project/p2/a/', time.time())
+        self.assertTrue(self.listing.covers('project/p2/a/x.bam'))
+        self.assertTrue(self.listing.covers('project/p1/zz'))
+        self.assertFalse(self.listing.covers('project/p2/b/x.bam'))
+        self.assertFalse(self.listing.covers('project/p2/'))
+        self.assertFalse(self.listing.covers('other/'))
+        self.listing.unmark('project/p1/')
+        self.assertFalse(self.listing.covers('project/p1/a/'))
+        self.assertEqual(self.listing.prefixes, ['project/', 'project/p2/a/'])
+
+    def test_hold(self):
+        self.listing.mark('project/p1/', time.time() - 61)
+        with self.listing.hold():
+            self.assertFalse(self.listing.covers('project/p1/a/'))
+            self.listing.mark('project/p1/', time.time())
+            self.listing.ttl = 0
+            self.assertTrue(self.listing.covers('project/p1/a/'))
+        self.assertFalse(self.listing.covers('project/p1/a/'))
+
+    def test_exists(self):
+        self.assertTrue(self.listing.exists('project/p1/a/1.bam'))
+        self.assertTrue(self.listing.exists('project/p1/b/'))
+        self.assertFalse(self.listing.exists('project/p1/c/'))
+        self.assertFalse(self.listing.exists('project/p1/b/3.bam'))
+
+    def test_size(self):
+        self.assertEqual(self.listing.size('project/p1/a/1.bam'), 11)
+        self.assertEqual(self.listing.size('project/p1/'), 31)
+        self.assertEqual(self.listing.size('project/p1/b/empty'), 0)
+
+    def test_remove_and_drop(self):
+        self.listing.remove(['project/p1/a/1.bam', 'project/p1/b/empty', 'project/p1/not_listed'])
+        self.assertEqual(self.listing.keys, ['project/p1/a/1.bam.bai', 'project/p1/b/2.bam'])
+        self.listing.drop('project/p1/a/')
+        self.assertEqual(self.listing.keys, ['project/p1/b/2.bam'])
+        self.assertEqual(self.listing.sizes, {'project/p1/b/2.bam': 20})
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.fname = os.path.join(self.path, 'a.fq')
+        with open(self.fname, 'w') as f:
+            f.write('@read1')
+        self.cache = HashCache(os.path.join(self.path, 'cache', 'md5.pkl'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_reuse_across_runs(self):
+        self.assertEqual(self.cache.md5(self.fname), hashlib.md5('@read1').hexdigest())
+        self.cache.save()
+        cache = HashCache(self.cache.path)
+        cache.load()[cache.load().keys()[0]] = 'cached'
+        self.assertEqual(cache.md5(self.fname), 'cached')
+
+    def test_changed_file(self):
+        self.cache.md5(self.fname)
+        with open(self.fname, 'w') as f:
+            f.write('@read2')
+        os.utime(self.fname, (0, 0))
+        self.assertEqual(self.cache.md5(self.fname), hashlib.md5('@read2').hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()
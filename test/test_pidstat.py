@@ -0,0 +1,96 @@
+from core.pidstat import Column, parse_pidstat, parse_disk_usage, normalize_time
+import numpy as np
+import pandas as pd
+import unittest
+
+PIDSTAT = """Linux 3.10.0-514.el7.x86_64 (iZ2ze)\t03/12/2018\t_x86_64_\t(4 CPU)
+
+#      Time   UID       PID    %usr %system    %CPU   CPU     VSZ   Command
+ 1520837101     0       656    0.00    0.00    0.00     2  126220  /usr/sbin/crond -n
+ 1520837101     0      1873   95.50    1.50   97.00     1  191036  java -jar /opt/gatk.jar  -T HaplotypeCaller
+ 1520837101     0      1874    0.00    0.00    0.00     3   10848  pidstat -h 60
+
+#      Time   UID       PID    %usr %system    %CPU   CPU     VSZ   Command
+ 1520837161     0      1873   99.00    1.00  100.00     1  191036  java -jar /opt/gatk.jar  -T HaplotypeCaller
+ 1520837161     0      1990   12.25    0.00   12.25     0    4096  bwa mem ref.fa r1.fq
+"""
+
+DISK_USAGE = """Filesystem     1K-blocks    Used Available Use% Mounted on
+/dev/xvda1      41152832 3000000  36000000  10% /
+/dev/xvdb1     103080224   60000  90000000   1% /data
+127.0.0.1:/x           1       1         1   1% /mnt/x
+Filesystem     1K-blocks    Used Available Use% Mounted on
+/dev/xvda1      41152832 3000100  36000000  10% /
+/dev/xvdb1     103080224   61000  90000000   1% /data
+"""
+
+class TestParsePidstat(unittest.TestCase):
+    def setUp(self):
+        self.date, self.columns = parse_pidstat(PIDSTAT.split('\n'), block_size=2)
+
+    def test_columns(self):
+        self.assertEqual(self.date, '03/12/2018')
+        self.assertEqual(self.columns.keys(), ['index', 'Time', 'UID', 'PID', '%usr', '%system', '%CPU', 'CPU', 'VSZ', 'Command', 'Program'])
+
+    def test_skip_cron_and_pidstat(self):
+        self.assertEqual(self.columns['index'].tolist(), [1, 3, 4])
+        self.assertEqual(self.columns['Program'].tolist(), ['gatk.jar', 'gatk.jar', 'bwa'])
+        self.assertEqual(self.columns['Command'][0], 'java -jar /opt/gatk.jar -T HaplotypeCaller')
+
+    def test_typed(self):
+        self.assertEqual(self.columns['Time'].dtype, 'int64')
+        self.assertEqual(self.columns['%CPU'].dtype, 'float64')
+        self.assertEqual(self.columns['%CPU'].tolist(), [97.0, 100.0, 12.25])
+        self.assertEqual(self.columns['Command'].dtype, object)
+
+    def test_too_short(self):
+        self.assertIsNone(parse_pidstat(['Linux', '']))
+
+class TestColumn(unittest.TestCase):
+    def extend(self, *blocks):
+        column = Column('x')
+        for values in blocks:
+            column.extend(values)
+        return column.to_array()
+
+    def test_int(self):
+        values = self.extend(['0', '1'], ['-2', '3'])
+        self.assertEqual(values.dtype, 'int64')
+        self.assertEqual(values.tolist(), [0, 1, -2, 3])
+
+    def test_promote_float(self):
+        values = self.extend(['0', '1'], ['2', '1.5'])
+        self.assertEqual(values.dtype, 'float64')
+        self.assertEqual(values.tolist(), [0.0, 1.0, 2.0, 1.5])
+
+    def test_promote_na(self):
+        values = self.extend(['0', '1'], ['N/A'])
+        self.assertEqual(values.dtype, 'float64')
+        self.assertEqual(values[:2].tolist(), [0.0, 1.0])
+        self.assertTrue(np.isnan(values[2]))
+
+    def test_promote_object(self):
+        values = self.extend(['0', '1'], ['1.5'], ['-'])
+        self.assertEqual(values.dtype, object)
+        self.assertEqual(values.tolist(), [0.0, 1.0, 1.5, '-'])
+
+    def test_not_truncated(self):
+        self.assertEqual(self.extend(['1', '2.5']).tolist(), [1.0, 2.5])
+        self.assertEqual(self.extend(['1', '1e3']).tolist(), [1.0, 1000.0])
+
+class TestNormalizeTime(unittest.TestCase):
+    def test_epoch(self):
+        for times in [pd.Series([1520837101, 1520837161]), pd.Series([1520837101.0, 1520837161.5])]:
+            self.assertEqual((normalize_time(times, '03/12/2018') / np.timedelta64(1, 's')).tolist(), [0, times[1] - times[0]])
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, normalize_time, pd.Series([1.5, '-'], dtype=object), '03/12/2018')
+
+class TestParseDiskUsage(unittest.TestCase):
+    def test_used(self):
+        sys_used, data_used = parse_disk_usage(DISK_USAGE.split('\n'))
+        self.assertEqual(sys_used.tolist(), [3000000, 3000100])
+        self.assertEqual(data_used.tolist(), [60000, 61000])
+
+if __name__ == '__main__':
+    unittest.main()
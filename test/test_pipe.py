@@ -0,0 +1,100 @@
+from core.pipe import Pipe
+import unittest
+import tempfile
+import shutil
+import yaml
+import os
+
+def app_config(name, inputs, parameters, cmd_template):
+    return {'app': {
+        'name': name,
+        'alias': name,
+        'requirements': {
+            'container': {'type': 'docker', 'image': 'user/' + name},
+            'resources': {'cpu': 1, 'mem': '1G', 'disk': '10G'}},
+        'inputs': inputs,
+        'outputs': {},
+        'parameters': parameters,
+        'cmd_template': cmd_template}}
+
+def string_param(default):
+    return {'separator': '', 'prefix': '', 'type': 'string', 'required': True, 'default': default, 'quotes': False, 'hint': ''}
+
+def file_input(default):
+    return {'hint': '', 'type': 'file', 'required': True, 'minitems': 1, 'maxitems': 1,
+        'item': {'separator': ' '}, 'formats': ['fq'], 'default': default}
+
+class TestBuildApps(unittest.TestCase):
+    """
+    building apps in a process pool writes the same scripts as the serial build
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.pipe_path = os.path.join(self.path, 'pipe')
+        self.dump({'name': 'QC',
+            'Clean': {'sh_file': 'sh/{{parameters.sample_name}}/Clean.sh', 'depends': []},
+            'Report': {'sh_file': 'sh/Report.sh', 'depends': ['Clean']}},
+            'pipe/QC/dependencies.yaml')
+        self.dump(app_config('Clean',
+            {'reads': file_input('')},
+            {'sample_name': string_param(''), 'level': string_param('1')},
+            'clean {{parameters.sample_name}} {{parameters.level}} {{inputs.reads[0].path}}'),
+            'pipe/QC/Clean/config.yaml')
+        self.dump(app_config('Report',
+            {'summary': file_input('/data/summary.txt')},
+            {'title': string_param('qc')},
+            'report {{parameters.title}} {{inputs.summary[0].path}}'),
+            'pipe/QC/Report/config.yaml')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def dump(self, content, filename):
+        filename = os.path.join(self.path, filename)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            yaml.safe_dump(content, f, default_flow_style=False)
+        return filename
+
+    def build(self, jobs):
+        proj_path = os.path.join(self.path, 'jobs%d' % jobs)
+        parameter_file = self.dump({
+            'CommonParameters': {'ContractID': 'QC-1', 'project_description': 'qc', 'WORKSPACE': proj_path + '/'},
+            'CommonData': {},
+            'Groups': [],
+            'Samples': [{'sample_name': name, 'data': [{'reads': '/data/%s.fq' % name}]} for name in ('s1', 's2', 's3')],
+            'QC': {'Clean': {'level': '2'}, 'Report': {}}},
+            'jobs%d.yaml' % jobs)
+        pipe = Pipe(self.pipe_path)
+        pipe.proj_path = proj_path
+        pipe.verbose = False
+        pipe.loadParameters(parameter_file)
+        pipe.loadPipe(cache=False)
+        pipe.buildApps(jobs)
+
+        def relative(script):
+            script = dict(script)
+            script['filename'] = os.path.relpath(script['filename'], proj_path)
+            for m in script['mappings']:
+                m['source'] = m['source'].replace(proj_path, '')
+            return script
+
+        def read(filename):
+            with open(os.path.join(proj_path, filename)) as f:
+                return f.read()
+
+        scripts = {name: map(relative, app.scripts) for name, app in pipe.apps.iteritems()}
+        files = {s['filename']: read(s['filename']) for app_scripts in scripts.values() for s in app_scripts}
+        return scripts, files
+
+    def test_parallel_build(self):
+        serial_scripts, serial_files = self.build(1)
+        self.assertEqual(sorted(serial_files), ['sh/Report.sh', 'sh/s1/Clean.sh', 'sh/s2/Clean.sh', 'sh/s3/Clean.sh'])
+        self.assertEqual(serial_files['sh/s2/Clean.sh'], 'clean s2 2 /data/s2.fq')
+        parallel_scripts, parallel_files = self.build(2)
+        self.assertEqual(parallel_scripts, serial_scripts)
+        self.assertEqual(parallel_files, serial_files)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+from core.scheduler import Scheduler
+import unittest
+
+class TestScheduler(unittest.TestCase):
+    """
+    1 -> 3, 2 -> 3, 3 -> 4
+    """
+    def setUp(self):
+        states = [(1, 'running'), (2, 'finished'), (3, 'pending'), (4, 'pending'), (5, 'created'), (6, 'pending')]
+        depends = [(3, 1), (3, 2), (4, 3)]
+        self.scheduler = Scheduler(states, depends)
+
+    def test_init(self):
+        self.assertEqual(self.scheduler.to_sync(), [1])
+        self.assertEqual(self.scheduler.to_check(), [5, 6])
+        self.assertFalse(self.scheduler.is_ready(3))
+
+    def test_finish_release_successors(self):
+        self.scheduler.update(1, 'finished')
+        self.assertEqual(self.scheduler.to_sync(), [])
+        self.assertEqual(self.scheduler.to_check(), [3, 5, 6])
+        self.scheduler.update(3, 'waiting')
+        self.assertEqual(self.scheduler.to_check(), [5, 6])
+        self.scheduler.update(3, 'finished')
+        self.assertEqual(self.scheduler.to_check(), [4, 5, 6])
+
+    def test_redo_block_successors(self):
+        self.scheduler.update(1, 'finished')
+        self.scheduler.update(2, 'pending')
+        self.assertFalse(self.scheduler.is_ready(3))
+        self.assertEqual(self.scheduler.to_check(), [2, 5, 6])
+
+    def test_start_created(self):
+        self.scheduler.update(5, 'pending')
+        self.assertEqual(self.scheduler.to_check(), [5, 6])
+        self.scheduler.update(5, 'waiting')
+        self.assertEqual(self.scheduler.to_sync(), [1, 5])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+import subprocess
+import sys
+import os
+
+SNAP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snap.py')
+HEAVY_MODULES = ['dash', 'plotly', 'pandas', 'numpy', 'flask', 'core.ali.price', 'core.gantt', 'core.profile']
+
+class TestStartup(unittest.TestCase):
+    """
+    snap.py should not load web apps or pandas until a subcommand needs them
+    """
+    def test_lazy_modules(self):
+        code = "import sys, imp; sys.argv = ['snap.py']; imp.load_source('snap_cli', %r); print 'loaded:', ' '.join(sorted(set(%r) & set(sys.modules)))"
+        out = subprocess.check_output([sys.executable, '-c', code % (SNAP, HEAVY_MODULES)])
+        loaded = out.rstrip('\n').split('\n')[-1]
+        self.assertEqual(loaded.strip(), 'loaded:')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from core import store, models
+from core.store import ProfileStore
+from argparse import Namespace
+import pandas as pd
+import numpy as np
+import unittest
+import tempfile
+import shutil
+import os
+
+def make_profile(programs, samples=3):
+    n_row = len(programs) * samples
+    return pd.DataFrame({
+        'Time': pd.to_timedelta(np.repeat(np.arange(samples) * 60, len(programs)), unit='s'),
+        'Program': programs * samples,
+        'file': 'A.1',
+        '%CPU': np.arange(n_row, dtype=float),
+        '%MEM': np.ones(n_row),
+        'App': 'A',
+        'Module': 'M',
+        'Instance': 'ecs.sn1.medium'})
+
+class TestProfileStore(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = ProfileStore('P', root=self.root)
+        self.store.write('A', 1, make_profile(['bwa', 'gatk.jar']), [['a.1.pidstat', 'etag']])
+        self.store.write('B', 2, make_profile(['samtools']), [['b.1.pidstat', 'etag']])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_partitions(self):
+        self.assertEqual(self.store.partitions(), [('A', 1), ('B', 2)])
+        self.assertEqual(self.store.partitions(apps=['B']), [('B', 2)])
+        self.assertEqual(self.store.signature('A', 1), [['a.1.pidstat', 'etag']])
+        self.assertIsNone(self.store.signature('A', 2))
+
+    def test_roundtrip(self):
+        profiles = make_profile(['bwa', 'gatk.jar'])
+        loaded = self.store.query(tasks=[1])
+        pd.testing.assert_frame_equal(loaded[profiles.columns], profiles)
+
+    def test_query(self):
+        loaded = self.store.query(columns=['Program', '%CPU'], where={'Program': ['gatk.jar', 'samtools']}, start=60 * 10 ** 9)
+        self.assertEqual(list(loaded.columns), ['%CPU', 'Program'])
+        self.assertEqual(loaded.Program.tolist(), ['gatk.jar', 'gatk.jar', 'samtools', 'samtools'])
+        self.assertEqual(loaded['%CPU'].tolist(), [3.0, 5.0, 1.0, 2.0])
+        self.assertTrue(self.store.query(where={'Program': ['bash']}).empty)
+
+    def test_rewrite_moves_app(self):
+        self.store.write('C', 1, make_profile(['bash']))
+        self.assertEqual(self.store.partitions(), [('C', 1), ('B', 2)])
+
+    def test_summary(self):
+        summary = self.store.summary(tasks=[1])
+        self.assertEqual(summary.Program.tolist(), ['bwa', 'gatk.jar'])
+        self.assertEqual(summary.samples.tolist(), [3, 3])
+        self.assertEqual(summary.duration.tolist(), [120.0, 120.0])
+        self.assertEqual(summary['max %CPU'].tolist(), [4.0, 5.0])
+        self.assertEqual(self.store.numeric_columns(), ['%CPU', '%MEM', 'Time'])
+
+    def test_empty(self):
+        self.store.write('A', 3, None, [['a.3.pidstat', 'etag']])
+        self.store.write('A', 4, make_profile(['bwa']).iloc[:0], [['a.4.pidstat', 'etag']])
+        self.assertEqual(self.store.partitions(apps=['A']), [('A', 1), ('A', 3), ('A', 4)])
+        self.assertEqual(self.store.signature('A', 3), [['a.3.pidstat', 'etag']])
+        self.assertEqual(self.store.signature('A', 4), [['a.4.pidstat', 'etag']])
+        self.assertEqual(len(self.store.query(tasks=[3, 4], where={'Program': ['bwa']}, start=0)), 0)
+        self.assertEqual(len(self.store.query()), 9)
+        self.assertEqual(self.store.summary(tasks=[3, 4]).Program.tolist(), [])
+        self.assertEqual(self.store.numeric_columns(), ['%CPU', '%MEM', 'Time'])
+
+class FakeTask(object):
+    def __init__(self, task_id):
+        self.id = task_id
+        self.app = Namespace(name='A')
+
+    def profile_files(self):
+        return ([Namespace(key='p/%d.1.pidstat' % self.id, etag='%d' % self.id)],
+            [Namespace(key='p/%d.1.disk_usage' % self.id, etag='%d' % self.id)])
+
+    def add_profile_columns(self, profiles):
+        return profiles
+
+class TestProjectProfile(unittest.TestCase):
+    """
+    logs are downloaded from a fake bucket and parsed into a fake store
+    """
+    def setUp(self):
+        self.written = []
+        self.most_files = [0]
+        self.patched = [(models, 'BUCKET', models.BUCKET), (store, 'ProfileStore', store.ProfileStore)]
+        models.BUCKET = Namespace(get_object_to_file=self.get_object_to_file)
+        store.ProfileStore = lambda project: Namespace(signature=lambda app, task_id: None, write=self.write)
+
+    def tearDown(self):
+        for module, name, value in self.patched:
+            setattr(module, name, value)
+
+    def get_object_to_file(self, key, path):
+        open(path, 'w').close()
+        self.most_files[0] = max(self.most_files[0], len(os.listdir(os.path.dirname(path))))
+
+    def write(self, app, task_id, profiles, signature=None):
+        self.written.append((task_id, profiles, signature))
+
+    def test_bounded_downloads(self):
+        models.Project(name='P').profile(map(FakeTask, range(1, 21)), threads=10, jobs=1)
+        signatures = {task_id: signature for task_id, profiles, signature in self.written}
+        self.assertEqual(sorted(signatures.keys()), range(1, 21))
+        self.assertEqual(signatures[1], [['p/1.1.pidstat', '1'], ['p/1.1.disk_usage', '1']])
+        # two tasks of one parser in flight, a pidstat and a disk_usage each
+        self.assertTrue(self.most_files[0] <= 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+from core.ali import oss, transfer
+from core.ali.transfer import Transfer
+from core.ali.oss import LISTING
+from core import models
+from core.models import Base, Project, Mapping, new_engine
+from sqlalchemy.orm import sessionmaker
+from argparse import Namespace
+from StringIO import StringIO
+import unittest
+import sys
+import tempfile
+import shutil
+import time
+import os
+
+class FakeBucket(object):
+    """
+    objects of a bucket kept in a dict of key => content
+    """
+    bucket_name = 'snap-test'
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def object_exists(self, key):
+        return key in self.objects
+
+    def iterate(self, prefix):
+        return iter([Namespace(key=k, size=len(v)) for k, v in sorted(self.objects.items()) if k.startswith(prefix)])
+
+    def batch_delete_objects(self, keys):
+        if not keys or len(keys) > 1000:
+            raise ValueError('delete 1 to 1000 keys at once')
+        map(lambda x: self.objects.pop(x, None), keys)
+        # oss reports every requested key as deleted, existing or not
+        return Namespace(deleted_keys=keys)
+
+class TransferTestCase(unittest.TestCase):
+    """
+    replace BUCKET, ObjectIterator and the oss copies with FakeBucket
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.bucket = FakeBucket({
+            'project/out/a.txt': 'a',
+            'project/out/sub/': '',
+            'project/out/sub/b.txt': 'bb',
+            'project/single.txt': 'single'})
+        self.failing = set()
+        self.patched = []
+        self.patch(oss, 'BUCKET', self.bucket)
+        self.patch(models, 'BUCKET', self.bucket)
+        self.patch(models, 'ObjectIterator', lambda bucket, prefix='': bucket.iterate(prefix))
+        self.patch(oss.oss2, 'ObjectIterator', lambda bucket, prefix='', max_keys=None: bucket.iterate(prefix))
+        self.patch(transfer, 'upload_file', self.upload_file)
+        self.patch(transfer, 'download_file', self.download_file)
+        LISTING.clear()
+
+    def tearDown(self):
+        for module, name, value in reversed(self.patched):
+            setattr(module, name, value)
+        LISTING.clear()
+        shutil.rmtree(self.path)
+
+    def patch(self, module, name, value):
+        self.patched.append((module, name, getattr(module, name)))
+        setattr(module, name, value)
+
+    def upload_file(self, key, filename, progress_callback=None):
+        if key in self.failing:
+            raise IOError('upload failed')
+        with open(filename) as f:
+            self.bucket.objects[key] = f.read()
+
+    def download_file(self, key, filename, size=None, progress_callback=None):
+        if key in self.failing:
+            raise IOError('download failed')
+        with open(filename, 'w') as f:
+            f.write(self.bucket.objects[key])
+
+    def local(self, *paths):
+        return os.path.join(self.path, *paths)
+
+    def write(self, path, content):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+class TestTransfer(TransferTestCase):
+    def test_download(self):
+        copies = Transfer(threads=2)
+        copies.download('project/out/sub/b.txt', self.local('x', 'y', 'b.txt'), 2)
+        copies.download('project/single.txt', self.local('single.txt'))
+        self.assertEqual(copies.run(), [])
+        with open(self.local('x', 'y', 'b.txt')) as f:
+            self.assertEqual(f.read(), 'bb')
+        self.assertTrue(os.path.exists(self.local('single.txt')))
+        self.assertEqual(copies.jobs, [])
+
+    def test_failed(self):
+        self.failing.add('project/out/a.txt')
+        copies = Transfer(threads=2)
+        copies.download('project/out/a.txt', self.local('a.txt'))
+        copies.download('project/single.txt', self.local('single.txt'))
+        copies.download('project/out/sub/b.txt', self.local('b.txt'))
+        failed = copies.run()
+        self.assertEqual([job for job, e in failed], [('download', 'project/out/a.txt', self.local('a.txt'))])
+        self.assertTrue(isinstance(failed[0][1], IOError))
+        self.assertFalse(os.path.exists(self.local('a.txt')))
+        self.assertTrue(os.path.exists(self.local('single.txt')))
+        self.assertTrue(os.path.exists(self.local('b.txt')))
+
+    def test_upload_listed(self):
+        LISTING.mark('project/', time.time())
+        self.write(self.local('c.txt'), 'ccc')
+        copies = Transfer()
+        copies.upload(self.local('c.txt'), 'project/up/c.txt')
+        copies.upload(self.local('c.txt'), 'other/c.txt')
+        self.assertEqual(copies.run(), [])
+        self.assertEqual(self.bucket.objects['project/up/c.txt'], 'ccc')
+        self.assertTrue(LISTING.exists('project/up/c.txt'))
+        self.assertEqual(LISTING.size('project/up/c.txt'), 3)
+        self.assertFalse(LISTING.exists('other/c.txt'))
+
+class TestMappingTransfer(TransferTestCase):
+    def jobs(self, mapping, direction):
+        copies = Transfer()
+        getattr(mapping, direction)(overwrite=True, transfer=copies)
+        return sorted(copies.jobs)
+
+    def test_single_file_into_directory(self):
+        mapping = Mapping(name='single', source=self.path + '/', destination='oss://snap-test/project/single.txt', is_write=True)
+        self.assertEqual(self.jobs(mapping, 'download'), [('download', 'project/single.txt', self.local('single.txt'))])
+
+    def test_prefix_download(self):
+        expected = [
+            ('download', 'project/out/a.txt', self.local('out', 'a.txt')),
+            ('download', 'project/out/sub/b.txt', self.local('out', 'sub', 'b.txt'))]
+        for source in [self.local('out'), self.local('out') + '/']:
+            mapping = Mapping(name='out', source=source, destination='oss://snap-test/project/out/', is_write=True)
+            self.assertEqual(self.jobs(mapping, 'download'), expected)
+
+    def test_prefix_download_listed(self):
+        LISTING.mark('project/', time.time())
+        map(lambda (k, v): LISTING.add(k, len(v)), self.bucket.objects.items())
+        self.patch(models, 'ObjectIterator', None)
+        mapping = Mapping(name='out', source=self.local('out'), destination='oss://snap-test/project/out/', is_write=True)
+        copies = Transfer()
+        mapping.download(transfer=copies)
+        self.assertEqual(sorted(copies.jobs), [
+            ('download', 'project/out/a.txt', self.local('out', 'a.txt')),
+            ('download', 'project/out/sub/b.txt', self.local('out', 'sub', 'b.txt'))])
+        self.assertEqual(copies.sizes[('download', 'project/out/a.txt', self.local('out', 'a.txt'))], 1)
+
+    def test_recursive_upload(self):
+        self.write(self.local('in', '1.txt'), '1')
+        self.write(self.local('in', 'a', 'b', '2.txt'), '22')
+        expected = [
+            ('upload', self.local('in', '1.txt'), 'project/in/1.txt'),
+            ('upload', self.local('in', 'a', 'b', '2.txt'), 'project/in/a/b/2.txt')]
+        for destination in ['oss://snap-test/project/in', 'oss://snap-test/project/in/']:
+            mapping = Mapping(name='in', source=self.local('in'), destination=destination, is_write=False)
+            self.assertEqual(self.jobs(mapping, 'upload'), expected)
+
+    def test_sync(self):
+        self.write(self.local('in', '1.txt'), '1')
+        self.patch(models, 'ALI_CONF', {})
+        mapping = Mapping(name='in', source=self.local('in'), destination='oss://snap-test/project/in/', is_write=False)
+        mapping.sync()
+        self.assertEqual(self.bucket.objects['project/in/1.txt'], '1')
+
+    def test_without_transfer(self):
+        self.write(self.local('in', '1.txt'), '1')
+        self.patch(models, 'ALI_CONF', {})
+        Mapping(name='in', source=self.local('in'), destination='oss://snap-test/project/in/', is_write=False).upload()
+        self.assertEqual(self.bucket.objects['project/in/1.txt'], '1')
+        Mapping(name='out', source=self.local('out'), destination='oss://snap-test/project/out/', is_write=True).download()
+        with open(self.local('out', 'sub', 'b.txt')) as f:
+            self.assertEqual(f.read(), 'bb')
+
+class TestCleanFiles(TransferTestCase):
+    def setUp(self):
+        super(TestCleanFiles, self).setUp()
+        self.session = sessionmaker(bind=new_engine(':memory:'))()
+        Base.metadata.create_all(self.session.get_bind())
+        self.project = Project(name='clean')
+        self.project.session = self.session
+
+    def tearDown(self):
+        self.session.close()
+        super(TestCleanFiles, self).tearDown()
+
+    def add_mappings(self, *destinations):
+        self.session.add_all([Mapping(name=str(i), source='/local/%d' % i, destination='oss://snap-test/' + d, is_write=True)
+            for i, d in enumerate(destinations)])
+        self.session.commit()
+
+    def clean(self, **kwargs):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.project.clean_files(immediate=False, threads=2, **kwargs)
+            return sys.stdout.getvalue().strip()
+        finally:
+            sys.stdout = stdout
+
+    def test_dry_run(self):
+        self.add_mappings('project/out/', 'project/single.txt')
+        objects = dict(self.bucket.objects)
+        self.assertEqual(self.clean(dry_run=True), '4 files(9.0 B) to be deleted.')
+        self.assertEqual(self.bucket.objects, objects)
+
+    def test_delete(self):
+        # missing.txt is in a listed folder and skipped, blind.txt is outside any listed folder
+        self.add_mappings('project/out/', 'project/single.txt', 'project/missing.txt', 'blind.txt')
+        self.bucket.objects['project/kept.txt'] = 'kept'
+        self.assertEqual(self.clean(), '5 files(9.0 B) deleted.')
+        self.assertEqual(self.bucket.objects, {'project/kept.txt': 'kept'})
+        self.assertEqual(LISTING.keys, ['project/kept.txt'])
+
+    def test_skip_empty_batches(self):
+        self.bucket.objects.update({'project/many/%04d' % i: 'x' for i in range(1000)})
+        self.add_mappings('project/many/')
+        self.assertEqual(self.clean(), '1000 files(1000.0 B) deleted.')
+        self.assertEqual(len(self.bucket.objects), 4)
+        self.session.query(Mapping).delete()
+        self.session.commit()
+        self.assertEqual(self.clean(), '0 files(0.0 B) deleted.')
+
+if __name__ == '__main__':
+    unittest.main()
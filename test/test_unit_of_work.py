@@ -0,0 +1,73 @@
+from core.models import Base, Project, Module, App, Task, Bcs, new_engine
+from sqlalchemy.orm import sessionmaker
+import unittest
+import tempfile
+import logging
+import shutil
+import os
+
+class TestUnitOfWork(unittest.TestCase):
+    """
+    transitions of a sync are committed once, each task in its own savepoint
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.engine = new_engine(os.path.join(self.path, 'snap.db'))
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.project = Project(name='batch')
+        self.project.session = self.session
+        self.project.logger = logging.getLogger('snap.test')
+        module = Module(name='module')
+        app = App(name='app', module=module)
+        self.tasks = [Task(shell='%d.sh' % i, project=self.project, module=module, app=app, cpu=1) for i in range(3)]
+        self.session.add_all(self.tasks)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.path)
+
+    def committed(self):
+        session = sessionmaker(bind=new_engine(os.path.join(self.path, 'snap.db')))()
+        try:
+            return sorted([t.cpu for t in session.query(Task).all()]), [b.id for b in session.query(Bcs).all()]
+        finally:
+            session.close()
+
+    def test_rollback_failing_task(self):
+        def change(task):
+            task.cpu = 2
+            if task.shell == '1.sh':
+                raise ValueError('broken task')
+
+        with self.project.unit_of_work():
+            results = map(lambda x: self.project.apply(x, change), self.tasks)
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(self.committed(), ([1, 2, 2], []))
+
+    def test_commit_submitted_job(self):
+        def submit(task):
+            task.aasm_state = 'waiting'
+            task.bcs.append(Bcs(id='job-%s' % task.shell))
+
+        with self.project.unit_of_work():
+            self.project.apply(self.tasks[0], submit)
+            self.assertEqual(self.committed()[1], ['job-0.sh'])
+            self.session.rollback()
+        self.assertEqual(self.committed()[1], ['job-0.sh'])
+
+    def test_commit_each_chunk(self):
+        def change(task):
+            seen.append(self.committed()[0])
+            task.cpu = 2
+
+        seen = []
+        with self.project.unit_of_work():
+            self.project.apply_all([t.id for t in self.tasks], change, step=2)
+        self.assertEqual(seen, [[1, 1, 1], [1, 1, 1], [1, 2, 2]])
+        self.assertEqual(self.committed(), ([2, 2, 2], []))
+
+if __name__ == '__main__':
+    unittest.main()